@@ -0,0 +1,283 @@
+#!/usr/bin/python
+"""Time the page extractors on the saved page corpus."""
+import argparse
+import collections
+import json
+import sys
+import timeit
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+from check_corpus import PARSERS, get_corpus_pages
+from page_parser import (
+    clean_name,
+    find_track_details,
+    get_album_links,
+    get_collection_id,
+    get_track_links,
+    has_album_detail,
+    has_json_data,
+    scan_page,
+)
+
+BACKENDS = ["html.parser", "lxml", "html5lib"]
+
+Result = collections.namedtuple(
+    "Result", ["page", "extractor", "backend", "seconds", "elements"]
+)
+
+
+def get_album_divs(soup):
+    """Return the divs has_album_detail checks on a collection page."""
+    div_album_collection = soup.find("div", attrs={"data-testid": "CollectionGridView"})
+    if div_album_collection is None:
+        return []
+
+    return [
+        a_div
+        for a_tag in div_album_collection.find_all("a")
+        for a_div in a_tag.find_all("div")
+    ]
+
+
+def get_titles(kind, soup):
+    """Return the raw titles clean_name gets for a page."""
+    if kind == "collection":
+        if soup.find("div", attrs={"data-testid": "CollectionGridView"}) is None:
+            return []
+        return [album_title for album_title, _, _ in get_album_links(soup)]
+
+    if kind == "track":
+        title = find_track_details(soup).title
+        return [title] if title else []
+
+    titles = [h1.text for h1 in soup.select("header > h1")]
+    script = soup.find("script", attrs={"type": "application/json"})
+    if script is not None:
+        page_props = json.loads(script.get_text())["props"]["pageProps"]
+        titles += [item["title"] for item in page_props.get("items", [])]
+
+    return titles
+
+
+def get_extractors(kind, soup):
+    """Return (name, function, elements) to time on a parsed page.
+
+    A function takes no arguments and returns json friendly output so
+    backends can be compared. elements are what the function loops over.
+    """
+    extractors = [
+        ("has_json_data", lambda: has_json_data(soup), None),
+        ("get_collection_id", lambda: get_collection_id(soup), soup.find_all("a")),
+    ]
+
+    if kind == "collection":
+        album_divs = get_album_divs(soup)
+        extractors += [
+            (
+                "has_album_detail",
+                lambda: [has_album_detail(a) for a in album_divs],
+                album_divs,
+            ),
+        ]
+        if album_divs:
+            extractors.append(
+                ("get_album_links", lambda: get_album_links(soup), album_divs)
+            )
+    elif kind == "album":
+        if soup.find("div", attrs={"data-testid": "CollectionListView"}) is not None:
+            extractors.append(("get_track_links", lambda: get_track_links(soup), None))
+    else:
+        extractors.append(
+            ("find_track_details", lambda: list(find_track_details(soup)), None)
+        )
+
+    titles = get_titles(kind, soup)
+    extractors.append(("clean_name", lambda: [clean_name(t) for t in titles], titles))
+    return extractors
+
+
+def time_call(func, repeat, min_time=0.02):
+    """Return the best time of one func call in seconds.
+
+    Each of the repeats calls func enough times to take about min_time.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    elapsed = timer.timeit(number)
+    while elapsed < min_time / 10:
+        number *= 10
+        elapsed = timer.timeit(number)
+    number = max(number, int(number * min_time / elapsed))
+
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def get_backends(names):
+    """Return the backends BeautifulSoup can use."""
+    backends = []
+    for name in names:
+        try:
+            BeautifulSoup("", name)
+        except FeatureNotFound:
+            print(f"Skipping {name}, it is not installed.", file=sys.stderr)
+            continue
+        backends.append(name)
+
+    return backends
+
+
+def compare_output(outputs, page_path, name, backend, output):
+    """Keep the first output per extractor and describe any that differ."""
+    expected_backend, expected = outputs.setdefault(name, (backend, output))
+    if output == expected:
+        return []
+
+    return [
+        f"{page_path} {name}: {expected_backend} gave {expected}, "
+        f"{backend} gave {output}"
+    ]
+
+
+def bench_soup(  # pylint: disable=too-many-arguments
+    kind, page_path, text, backend, repeat, outputs
+):
+    """Time building the soup and each extractor with one backend."""
+    results = [
+        Result(
+            page_path,
+            "soup",
+            backend,
+            time_call(lambda: BeautifulSoup(text, backend), repeat),
+            None,
+        )
+    ]
+    mismatches = []
+    soup = BeautifulSoup(text, backend)
+    for name, func, elements in get_extractors(kind, soup):
+        results.append(
+            Result(
+                page_path,
+                name,
+                backend,
+                time_call(func, repeat),
+                None if elements is None else len(elements),
+            )
+        )
+        output = json.loads(json.dumps(func()))
+        mismatches += compare_output(outputs, page_path, name, backend, output)
+
+    return results, mismatches
+
+
+def bench_page(kind, page_path, backends, repeat):
+    """Time every extractor on a page with each backend.
+
+    Returns (results, mismatches). Outputs from each backend are compared
+    with the first backend's, and the regex scan with the soup lookups.
+    """
+    with open(page_path, encoding="utf-8") as file:
+        text = file.read()
+
+    results = []
+    mismatches = []
+    outputs = {}
+    for backend in backends:
+        backend_results, backend_mismatches = bench_soup(
+            kind, page_path, text, backend, repeat, outputs
+        )
+        results += backend_results
+        mismatches += backend_mismatches
+
+    results += [
+        Result(
+            page_path,
+            "scan_page",
+            "regex",
+            time_call(lambda: scan_page(text), repeat),
+            None,
+        ),
+        Result(
+            page_path,
+            f"parse_{kind}_page",
+            "regex",
+            time_call(lambda: PARSERS[kind](text), repeat),
+            None,
+        ),
+    ]
+    scan = scan_page(text)
+    mismatches += compare_output(
+        outputs, page_path, "has_json_data", "scan_page", scan.has_json
+    )
+    mismatches += compare_output(
+        outputs, page_path, "get_collection_id", "scan_page", scan.collection_id
+    )
+
+    return results, mismatches
+
+
+def print_results(results):
+    """Print a table of per page and per element times in microseconds."""
+    print(
+        f"{'page':<28} {'extractor':<22} {'backend':<12} {'per page us':>12} "
+        f"{'elements':>9} {'per element us':>15}"
+    )
+    for page_path, name, backend, seconds, elements in results:
+        page_name = "/".join(page_path.split("/")[-2:])
+        per_element = f"{seconds / elements * 1e6:.2f}" if elements else ""
+        print(
+            f"{page_name:<28} {name:<22} {backend:<12} {seconds * 1e6:>12.2f} "
+            f"{'' if elements is None else elements:>9} {per_element:>15}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Page extractor micro benchmark.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "--backend",
+        "-b",
+        action="append",
+        choices=BACKENDS,
+        help="BeautifulSoup backend to time. Defaults to every installed backend.",
+    )
+    parser.add_argument(
+        "--kind",
+        "-k",
+        action="append",
+        choices=list(PARSERS),
+        help="Page kinds to time.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timing repeats per extractor."
+    )
+    parser.add_argument("--output", "-o", help="Write the results to a json file.")
+    args = parser.parse_args()
+
+    installed_backends = get_backends(args.backend or BACKENDS)
+    all_results = []
+    all_mismatches = []
+    for page_kind, path in get_corpus_pages():
+        if args.kind and page_kind not in args.kind:
+            continue
+        page_results, page_mismatches = bench_page(
+            page_kind, path, installed_backends, args.repeat
+        )
+        all_results += page_results
+        all_mismatches += page_mismatches
+
+    print_results(all_results)
+    for mismatch in all_mismatches:
+        print(f"MISMATCH {mismatch}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out_file:
+            json.dump(
+                [result._asdict() for result in all_results],
+                out_file,
+                indent=2,
+            )
+
+    sys.exit(1 if all_mismatches else 0)
@@ -0,0 +1,385 @@
+#!/usr/bin/python
+"""End to end crawl benchmark against a local stand-in music site."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+COLLECTION_PATH_PATTERN = "/api/collection/collection_id"
+CHUNK_SIZE = 16 * 1024
+# Album page shapes, picked by album number.
+ALBUM_KINDS = ["json", "api", "html"]
+# One MPEG 1 layer III frame header, 128 kbps at 44.1 kHz.
+MPEG_FRAME_HEADER = b"\xff\xfb\x90\x00"
+MPEG_FRAME_SIZE = 417
+
+
+def get_percentile_ms(seconds, percentile):
+    """Return the nearest rank percentile of durations in milliseconds."""
+    if not seconds:
+        return None
+
+    ordered = sorted(seconds)
+    index = max(0, int(round(percentile / 100 * len(ordered))) - 1)
+    return round(ordered[index] * 1000, 2)
+
+
+def get_ms(seconds):
+    """Return seconds in milliseconds, keeping None."""
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def get_padding(count):
+    """Return filler markup so pages have a realistic size."""
+    cards = "".join(
+        f'<div class="card"><div><span>Related {idx}</span>'
+        f'<a href="/related/{idx}">Open</a></div></div>'
+        for idx in range(count)
+    )
+    return f"<aside>{cards}</aside>"
+
+
+def get_page(title, body, padding):
+    """Wrap body in the shared page layout."""
+    return (
+        "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+        f"<title>{title}</title><script src='/static/app.js'></script></head>"
+        "<body><div id='__next'><header><nav><a href='/'>Home</a>"
+        f"<button>Menu</button></nav><h1>{title}</h1></header><main>{body}</main>"
+        f"{padding}<footer><section><p>Terms</p></section></footer></div>"
+        "</body></html>"
+    )
+
+
+def get_json_script(data):
+    """Return a pageProps script tag."""
+    return (
+        '<script id="__NEXT_DATA__" type="application/json">'
+        f"{json.dumps(data)}</script>"
+    )
+
+
+def get_mp3(name, size):
+    """Return an mp3 body of exactly size bytes, unique to name."""
+    tag_data = name.encode("utf-8")
+    # ID3 sizes are syncsafe, seven bits per byte.
+    tag_size = bytes((len(tag_data) >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    header = b"ID3\x03\x00\x00" + tag_size + tag_data
+    frame = MPEG_FRAME_HEADER + bytes(MPEG_FRAME_SIZE - len(MPEG_FRAME_HEADER))
+    frames = frame * (max(0, size - len(header)) // MPEG_FRAME_SIZE + 1)
+    return (header + frames)[:size]
+
+
+class StandInSite:  # pylint: disable=too-many-instance-attributes
+    """Local site with the page shapes of the real music site."""
+
+    def __init__(self, args):
+        """Configure the site from the command line arguments."""
+        self.collections = args.collections
+        self.albums = args.albums
+        self.tracks = args.tracks
+        self.track_size = args.track_size
+        self.latency = args.latency
+        self.bandwidth = args.bandwidth
+        self.error_rate = args.error_rate
+        self.padding = get_padding(args.padding)
+        self.base_url = None
+        self.page_latencies = []
+        self.bytes_sent = 0
+        self.errors = 0
+
+    def get_track_title(self, collection, album, track):
+        """Return a track title."""
+        return f"Hymn {collection}-{album}-{track}"
+
+    def get_audio_url(self, collection, album, track):
+        """Return a track's audio url."""
+        return f"{self.base_url}/audio/{collection}/{album}/{track}.mp3"
+
+    def get_items(self, collection, album):
+        """Return pageProps items for an album."""
+        return [
+            {
+                "id": f"{collection}-{album}-{track}",
+                "title": self.get_track_title(collection, album, track),
+                "downloads": [
+                    {
+                        "url": self.get_audio_url(collection, album, track),
+                        "size": self.track_size,
+                    }
+                ],
+            }
+            for track in range(self.tracks)
+        ]
+
+    @web.middleware
+    async def shape(self, request, handler):
+        """Add latency and injected errors, and time page responses."""
+        started = time.monotonic()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503, headers={"Retry-After": "0"})
+
+        response = await handler(request)
+        if not request.path.startswith("/audio/"):
+            self.page_latencies.append(time.monotonic() - started)
+        return response
+
+    async def collection_page(self, request):
+        """Serve a CollectionGridView collection page."""
+        collection = int(request.match_info["collection"])
+        cards = "".join(
+            f'<a href="/album/{collection}/{album}"><div><div>'
+            f"<div>{self.tracks} tracks</div><div>Album {collection}-{album}</div>"
+            "</div></div></a>"
+            for album in range(self.albums)
+        )
+        body = f'<div data-testid="CollectionGridView">{cards}</div>'
+        return web.Response(
+            text=get_page(f"Collection {collection}", body, self.padding),
+            content_type="text/html",
+        )
+
+    async def json_collection_page(self, request):
+        """Serve a pageProps collection page whose albums use the api."""
+        collection = int(request.match_info["collection"])
+        items = [
+            {"id": f"{collection}-{album}", "title": f"Album {collection}-{album}"}
+            for album in range(self.albums)
+        ]
+        script = get_json_script({"props": {"pageProps": {"items": items}}})
+        return web.Response(
+            text=get_page(f"Json Collection {collection}", script, self.padding),
+            content_type="text/html",
+        )
+
+    async def album_page(self, request):
+        """Serve a json, api or CollectionListView album page."""
+        collection = int(request.match_info["collection"])
+        album = int(request.match_info["album"])
+        title = f"Album {collection}-{album}"
+        kind = ALBUM_KINDS[album % len(ALBUM_KINDS)]
+
+        if kind == "json":
+            page_props = {"title": title, "items": self.get_items(collection, album)}
+            body = get_json_script({"props": {"pageProps": page_props}})
+        elif kind == "api":
+            body = f'<a href="/listen?collectionId={collection}-{album}">Listen</a>'
+        else:
+            links = "".join(
+                f'<a href="/track/{collection}/{album}/{track}">Track {track}</a>'
+                for track in range(self.tracks)
+            )
+            body = f'<div data-testid="CollectionListView">{links}</div>'
+
+        return web.Response(
+            text=get_page(title, body, self.padding), content_type="text/html"
+        )
+
+    async def collection_api(self, request):
+        """Serve the collection api json."""
+        collection, album = request.match_info["collection_id"].split("-")
+        return web.json_response({"items": self.get_items(int(collection), int(album))})
+
+    async def track_page(self, request):
+        """Serve a track page with a title and audio player."""
+        collection = int(request.match_info["collection"])
+        album = int(request.match_info["album"])
+        track = int(request.match_info["track"])
+        title = self.get_track_title(collection, album, track)
+        audio_url = self.get_audio_url(collection, album, track)
+        body = (
+            f"<div><div><h1>{title}</h1></div><div><button>Play</button></div>"
+            f'<section><audio src="{audio_url}"></audio></section></div>'
+        )
+        return web.Response(
+            text=get_page(title, body, self.padding), content_type="text/html"
+        )
+
+    async def audio(self, request):
+        """Stream an mp3 body at the configured bandwidth."""
+        body = get_mp3(request.path, self.track_size)
+        response = web.StreamResponse(
+            headers={"Content-Type": "audio/mpeg", "Content-Length": str(len(body))}
+        )
+        await response.prepare(request)
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start : start + CHUNK_SIZE]
+            await response.write(chunk)
+            self.bytes_sent += len(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        await response.write_eof()
+        return response
+
+    def get_app(self):
+        """Create the web app."""
+        app = web.Application(middlewares=[self.shape])
+        app.router.add_get("/collection/{collection}", self.collection_page)
+        app.router.add_get("/json-collection/{collection}", self.json_collection_page)
+        app.router.add_get("/album/{collection}/{album}", self.album_page)
+        app.router.add_get(
+            COLLECTION_PATH_PATTERN.replace("collection_id", "{collection_id}"),
+            self.collection_api,
+        )
+        app.router.add_get("/track/{collection}/{album}/{track}", self.track_page)
+        app.router.add_get("/audio/{collection}/{album}/{track}.mp3", self.audio)
+        return app
+
+    def get_site_urls(self):
+        """Return the collection urls, alternating grid and json collections."""
+        return [
+            f"{self.base_url}/{'json-collection' if idx % 2 else 'collection'}/{idx}"
+            for idx in range(self.collections)
+        ]
+
+
+def count_tracks(music_path):
+    """Count downloaded mp3 files outside the track store."""
+    count = 0
+    for _, dirs, files in os.walk(music_path):
+        dirs[:] = [folder for folder in dirs if not folder.startswith(".")]
+        count += sum(1 for file in files if file.endswith(".mp3"))
+    return count
+
+
+async def run_crawl(site, music_path, main_args):
+    """Run main.py against the site and return the report."""
+    site.page_latencies = []
+    site.bytes_sent = 0
+    site.errors = 0
+    command = [sys.executable, os.path.join(os.path.dirname(__file__), "main.py")]
+    for url in site.get_site_urls():
+        command += ["--site_url", url]
+    metrics_path = os.path.join(music_path, ".bench_metrics.json")
+    command += ["--music_path", music_path, "--metrics", metrics_path] + main_args
+    env = dict(os.environ, COLLECTION_PATH_PATTERN=COLLECTION_PATH_PATTERN)
+
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        env=env,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    await process.wait()
+    elapsed = time.monotonic() - started
+
+    tracks = count_tracks(music_path)
+    with open(metrics_path, encoding="utf-8") as file:
+        stages = json.load(file)["stages"]
+    fetch = stages.get("fetch", {})
+
+    return {
+        "exit_code": process.returncode,
+        "seconds": round(elapsed, 3),
+        "tracks": tracks,
+        "expected_tracks": site.collections * site.albums * site.tracks,
+        "tracks_per_sec": round(tracks / elapsed, 1),
+        "bytes": site.bytes_sent,
+        "bytes_per_sec": round(site.bytes_sent / elapsed),
+        "pages": len(site.page_latencies),
+        "page_p50_ms": get_percentile_ms(site.page_latencies, 50),
+        "page_p99_ms": get_percentile_ms(site.page_latencies, 99),
+        # Client side, including cache lookups, retries and the limiter.
+        "fetch_p50_ms": get_ms(fetch.get("p50")),
+        "fetch_p99_ms": get_ms(fetch.get("p99")),
+        "errors_injected": site.errors,
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+async def main(args, main_args):
+    """Serve the stand-in site and benchmark crawls against it."""
+    site = StandInSite(args)
+    runner = web.AppRunner(site.get_app(), access_log=None)
+    await runner.setup()
+    tcp_site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await tcp_site.start()
+    port = runner.addresses[0][1]
+    site.base_url = f"http://127.0.0.1:{port}"
+
+    if args.serve:
+        print(f"Serving {' '.join(site.get_site_urls())}")
+        print(f"COLLECTION_PATH_PATTERN={COLLECTION_PATH_PATTERN}")
+        await asyncio.Event().wait()
+
+    music_path = tempfile.mkdtemp(prefix="bench_music_")
+    reports = []
+    try:
+        # Later runs reuse the music folder, measuring incremental syncs.
+        for _ in range(args.runs):
+            report = await run_crawl(site, music_path, main_args)
+            reports.append(report)
+            print(json.dumps(report))
+    finally:
+        await runner.cleanup()
+        if not args.keep:
+            shutil.rmtree(music_path)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(reports, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - End to end benchmark.",
+        epilog="Arguments after -- are passed to main.py.",
+        add_help=True,
+    )
+    parser.add_argument("--collections", type=int, default=2)
+    parser.add_argument("--albums", type=int, default=15, help="Albums per collection.")
+    parser.add_argument("--tracks", type=int, default=100, help="Tracks per album.")
+    parser.add_argument(
+        "--track_size", type=int, default=32 * 1024, help="Bytes per mp3."
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response."
+    )
+    parser.add_argument(
+        "--bandwidth",
+        type=int,
+        default=0,
+        help="Bytes per second for each mp3 stream. 0 is unlimited.",
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Share of responses replaced with 503 errors.",
+    )
+    parser.add_argument(
+        "--padding", type=int, default=200, help="Filler cards on every page."
+    )
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--output", "-o", help="Write the reports to a json file.")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the downloaded music folder."
+    )
+    parser.add_argument(
+        "--serve", action="store_true", help="Only serve the site until stopped."
+    )
+
+    argv = sys.argv[1:]
+    passthrough = []
+    if "--" in argv:
+        passthrough = argv[argv.index("--") + 1 :]
+        argv = argv[: argv.index("--")]
+
+    asyncio.run(main(parser.parse_args(argv), passthrough))
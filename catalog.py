@@ -0,0 +1,188 @@
+"""Persistent catalog of the tracks the scraper found, with a title search."""
+import collections
+import os
+import sqlite3
+import time
+
+CatalogEntry = collections.namedtuple(
+    "CatalogEntry",
+    [
+        "path",
+        "collection",
+        "album",
+        "track_no",
+        "title",
+        "item_id",
+        "url",
+        "variant",
+        "size",
+        "tagged",
+    ],
+)
+
+COLUMNS = ", ".join(CatalogEntry._fields)
+
+# Keep the external content title index in step with the tracks table.
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS track_titles USING fts5(
+        title, album, collection, content='tracks', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN
+        INSERT INTO track_titles (rowid, title, album, collection)
+        VALUES (new.id, new.title, new.album, new.collection);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_delete AFTER DELETE ON tracks BEGIN
+        INSERT INTO track_titles (track_titles, rowid, title, album, collection)
+        VALUES ('delete', old.id, old.title, old.album, old.collection);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tracks_update AFTER UPDATE ON tracks BEGIN
+        INSERT INTO track_titles (track_titles, rowid, title, album, collection)
+        VALUES ('delete', old.id, old.title, old.album, old.collection);
+        INSERT INTO track_titles (rowid, title, album, collection)
+        VALUES (new.id, new.title, new.album, new.collection);
+    END
+    """,
+]
+
+
+def get_match_query(text):
+    """Turn search words into an FTS query for titles with every word."""
+    return " ".join(
+        '"' + word.replace('"', '""') + '"*' for word in text.split() if word
+    )
+
+
+class Catalog:
+    """Collection, album, position, title and source of each downloaded track.
+
+    Paths are kept relative to root, the music folder, so the catalog still
+    holds when the folder moves. Titles are searched with an FTS5 index, or
+    LIKE where sqlite is built without FTS5.
+    """
+
+    def __init__(self, path, root):
+        """Open or create the catalog database for the music folder root."""
+        self.root = root
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                collection TEXT,
+                album TEXT NOT NULL,
+                track_no INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                item_id TEXT,
+                url TEXT NOT NULL,
+                variant TEXT,
+                size INTEGER,
+                tagged INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS tracks_album ON tracks (collection, album)"
+        )
+        try:
+            for statement in FTS_SCHEMA:
+                self.connection.execute(statement)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self.connection.commit()
+
+    def get_relative_path(self, filepath):
+        """Return filepath relative to the music folder."""
+        return os.path.relpath(filepath, self.root)
+
+    def to_entry(self, row):
+        """Make an entry of a row, with its path under the music folder."""
+        return CatalogEntry(os.path.join(self.root, row[0]), *row[1:])
+
+    def record(  # pylint: disable=too-many-arguments
+        self, filepath, track, size=None, tagged=False
+    ):
+        """Insert or update the entry of a track saved at filepath."""
+        self.connection.execute(
+            f"""
+            INSERT INTO tracks ({COLUMNS}, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET
+                collection = excluded.collection,
+                album = excluded.album,
+                track_no = excluded.track_no,
+                title = excluded.title,
+                item_id = excluded.item_id,
+                url = excluded.url,
+                variant = excluded.variant,
+                size = excluded.size,
+                tagged = excluded.tagged,
+                updated = excluded.updated
+            """,
+            (
+                self.get_relative_path(filepath),
+                track.collection_title,
+                track.album_title,
+                track.track_no,
+                track.track_title,
+                track.item_id,
+                track.audio_src,
+                track.variant,
+                size,
+                int(tagged),
+                time.time(),
+            ),
+        )
+        self.connection.commit()
+
+    def get_all(self):
+        """Return every entry by path."""
+        rows = self.connection.execute(f"SELECT {COLUMNS} FROM tracks")
+        return {entry.path: entry for entry in map(self.to_entry, rows)}
+
+    def search(self, text, limit=50):
+        """Return the entries whose title, album or collection has every word."""
+        if self.has_fts:
+            query = f"""
+                SELECT {", ".join(f"tracks.{column}" for column in CatalogEntry._fields)}
+                FROM track_titles JOIN tracks ON tracks.id = track_titles.rowid
+                WHERE track_titles MATCH ? ORDER BY rank LIMIT ?
+            """
+            rows = self.connection.execute(query, (get_match_query(text), limit))
+        else:
+            words = [f"%{word}%" for word in text.split()]
+            where = " AND ".join(
+                ["(title || ' ' || album || ' ' || IFNULL(collection, '')) LIKE ?"]
+                * len(words)
+            )
+            rows = self.connection.execute(
+                f"SELECT {COLUMNS} FROM tracks WHERE {where or 1} LIMIT ?",
+                (*words, limit),
+            )
+
+        return [self.to_entry(row) for row in rows]
+
+    def move(self, filepath, new_filepath):
+        """Move the entry of a renamed track."""
+        new_path = self.get_relative_path(new_filepath)
+        self.connection.execute("DELETE FROM tracks WHERE path = ?", (new_path,))
+        self.connection.execute(
+            "UPDATE tracks SET path = ?, updated = ? WHERE path = ?",
+            (new_path, time.time(), self.get_relative_path(filepath)),
+        )
+        self.connection.commit()
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+"""Check page parsers against the saved page corpus."""
+import argparse
+import json
+import os
+import sys
+
+from page_parser import parse_album_page, parse_collection_page, parse_track_page
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+PARSERS = {
+    "collection": parse_collection_page,
+    "album": parse_album_page,
+    "track": parse_track_page,
+}
+
+
+def get_expected_path(page_path):
+    """Get the path of the recorded result for a page."""
+    return os.path.splitext(page_path)[0] + ".json"
+
+
+def get_corpus_pages():
+    """Return (kind, page path) for every saved page."""
+    pages = []
+    for kind in PARSERS:
+        folder = os.path.join(CORPUS_PATH, kind)
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(".html"):
+                pages.append((kind, os.path.join(folder, filename)))
+
+    return pages
+
+
+def parse_corpus_page(kind, page_path):
+    """Parse a saved page into json friendly data."""
+    with open(page_path, encoding="utf-8") as file:
+        text = file.read()
+
+    return json.loads(json.dumps(PARSERS[kind](text)._asdict()))
+
+
+def check_corpus(record=False):
+    """Compare parser output with the recorded results."""
+    failures = 0
+    for kind, page_path in get_corpus_pages():
+        result = parse_corpus_page(kind, page_path)
+        expected_path = get_expected_path(page_path)
+
+        if record:
+            with open(expected_path, "w", encoding="utf-8") as file:
+                json.dump(result, file, indent=2, sort_keys=True)
+                file.write("\n")
+            print(f"Recorded {expected_path}")
+            continue
+
+        with open(expected_path, encoding="utf-8") as file:
+            expected = json.load(file)
+
+        if result == expected:
+            print(f"OK {page_path}")
+        else:
+            failures += 1
+            print(f"FAIL {page_path}: expected {expected} got {result}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Parser regression corpus.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="Save the current parser output as the expected results.",
+    )
+    args = parser.parse_args()
+
+    sys.exit(1 if check_corpus(args.record) else 0)
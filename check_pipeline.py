@@ -0,0 +1,288 @@
+#!/usr/bin/python
+"""Check the crawl pipeline's download outcomes, and the tools reading them."""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+
+import aiohttp
+from aiohttp import web
+
+import main
+from manifest import Manifest
+from metrics import Metrics
+from plan import Track
+from rename_rules import DEFAULT_RULES_PATH, RenameRules
+from variants import VariantPolicy
+import verify
+
+# One MPEG 1 layer III frame, 128 kbps at 44.1 kHz.
+AUDIO = b"\xff\xfb\x90\x00" + bytes(413)
+# Seconds each mp3 takes, so tracks of one url overlap.
+AUDIO_DELAY = 0.05
+
+
+def get_album_page(title, items):
+    """Return a json album page listing items."""
+    data = {"props": {"pageProps": {"title": title, "items": items}}}
+    return web.Response(
+        text=(
+            f"<html><body><header><h1>{title}</h1></header>"
+            '<script id="__NEXT_DATA__" type="application/json">'
+            f"{json.dumps(data)}</script></body></html>"
+        ),
+        content_type="text/html",
+    )
+
+
+class LocalSite:
+    """Serves mp3 files, and broken ones as 503 html pages, counting requests."""
+
+    def __init__(self):
+        """Start with no requests."""
+        self.requests = {}
+        self.base_url = None
+
+    async def album(self, _request):
+        """Serve a json album page whose two tracks are broken."""
+        items = [
+            {
+                "id": f"t{track}",
+                "title": f"Song {track}",
+                "downloads": [{"url": f"{self.base_url}/broken/{track}.mp3"}],
+            }
+            for track in (1, 2)
+        ]
+        return get_album_page("Album", items)
+
+    async def m4a_album(self, _request):
+        """Serve a json album page of a renumbered album with m4a and mp3 tracks."""
+        downloads = [
+            {"url": f"{self.base_url}/audio/1.mp3", "format": "mp3"},
+            {"url": f"{self.base_url}/audio/1.m4a", "format": "m4a"},
+        ]
+        items = [{"id": "t1", "title": "Song 1", "downloads": downloads}]
+        return get_album_page("Hymns-Music Only", items)
+
+    async def audio(self, request):
+        """Serve an mp3 after AUDIO_DELAY."""
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        await asyncio.sleep(AUDIO_DELAY)
+        return web.Response(body=AUDIO, content_type="audio/mpeg")
+
+    async def broken(self, request):
+        """Serve an error page instead of an mp3."""
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        return web.Response(
+            status=503, text="<html>Busy</html>", content_type="text/html"
+        )
+
+    def get_app(self):
+        """Return the site's web app."""
+        app = web.Application()
+        app.router.add_get("/album", self.album)
+        app.router.add_get("/m4a_album", self.m4a_album)
+        app.router.add_get("/audio/{name}", self.audio)
+        app.router.add_get("/broken/{name}", self.broken)
+        return app
+
+
+@contextlib.asynccontextmanager
+async def serve_site():
+    """Serve a LocalSite on a free localhost port."""
+    site = LocalSite()
+    runner = web.AppRunner(site.get_app(), access_log=None)
+    await runner.setup()
+    tcp_site = web.TCPSite(runner, "127.0.0.1", 0)
+    await tcp_site.start()
+    site.base_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    try:
+        yield site
+    finally:
+        await runner.cleanup()
+
+
+@contextlib.asynccontextmanager
+async def open_pipeline(**options):
+    """Open a pipeline downloading into a temporary music folder."""
+    with tempfile.TemporaryDirectory(prefix="check_music_") as music_path:
+        main.MUSIC_PATH = music_path
+        manifest = Manifest(os.path.join(music_path, ".manifest.sqlite"))
+        try:
+            async with aiohttp.ClientSession() as session:
+                yield main.Pipeline(
+                    session,
+                    download_workers=4,
+                    manifest=manifest,
+                    metrics=Metrics(),
+                    **options,
+                )
+        finally:
+            manifest.close()
+
+
+async def download_tracks(pipeline, tracks):
+    """Run the pipeline over tracks and return its counters."""
+
+    async def seed():
+        for track in tracks:
+            await pipeline.add_download(track)
+
+    await pipeline.run(seed())
+    return dict(pipeline.metrics.counters)
+
+
+def run_verify(music_path):
+    """Run verify.py over music_path, requeueing bad tracks, and return its exit code."""
+    verify.MUSIC_PATH = music_path
+    verify.MANIFEST_PATH = None
+    verify.WORKERS = 1
+    verify.PROCESSES = False
+    verify.REQUEUE = True
+    verify.OUTPUT_PATH = None
+    with contextlib.redirect_stdout(None):
+        return verify.main()
+
+
+async def check_failed_download():
+    """Check that a track served an error page counts as a download error."""
+    async with serve_site() as site, open_pipeline() as pipeline:
+        url = f"{site.base_url}/broken/1.mp3"
+        counters = await download_tracks(
+            pipeline, [Track(None, "A0", 1, "Song", url, None)]
+        )
+
+    problems = []
+    if counters.get("download_errors") != 1:
+        problems.append(f"download_errors {counters.get('download_errors')}")
+    if counters.get("tracks_skipped"):
+        problems.append(f"tracks_skipped {counters['tracks_skipped']}")
+    return problems
+
+
+async def check_failed_job():
+    """Check that a worker job whose tracks fail reports errors."""
+    async with serve_site() as site, open_pipeline() as pipeline:
+        status = await main.run_job(
+            pipeline, pipeline.metrics, 1, (f"{site.base_url}/album", True)
+        )
+
+    problems = []
+    if status["status"] != "errors":
+        problems.append(f"status {status['status']}")
+    if status["counters"].get("download_errors") != 2:
+        problems.append(f"counters {status['counters']}")
+    return problems
+
+
+async def check_shared_download():
+    """Check that every album of a track in three albums gets its file."""
+    async with serve_site() as site, open_pipeline() as pipeline:
+        url = f"{site.base_url}/audio/1.mp3"
+        tracks = [Track(None, f"A{album}", 1, "Song", url, None) for album in range(3)]
+        counters = await download_tracks(pipeline, tracks)
+        missing = [
+            track.album_title
+            for track in tracks
+            if not os.path.isfile(main.get_track_file_name(track))
+        ]
+
+    problems = []
+    if missing:
+        problems.append(f"missing in {', '.join(missing)}")
+    if site.requests != {"/audio/1.mp3": 1}:
+        problems.append(f"requests {site.requests}")
+    if counters.get("tracks_downloaded") != 1 or counters.get("tracks_skipped") != 2:
+        problems.append(f"counters {counters}")
+    return problems
+
+
+async def check_verify_relative_path():
+    """Check that verify.py requeues a truncated track in a relative music folder."""
+    async with serve_site() as site, open_pipeline() as pipeline:
+        url = f"{site.base_url}/audio/1.mp3"
+        track = Track(None, "A0", 1, "Song", url, None)
+        await download_tracks(pipeline, [track])
+        filename = main.get_track_file_name(track)
+        os.truncate(filename, 300)
+
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(main.MUSIC_PATH))
+        try:
+            exit_code = run_verify(os.path.basename(main.MUSIC_PATH))
+        finally:
+            os.chdir(cwd)
+
+        problems = []
+        if exit_code != 1:
+            problems.append(f"exit code {exit_code}")
+        if os.path.exists(filename) or pipeline.manifest.get(url):
+            problems.append("truncated track not requeued")
+        return problems
+
+
+async def check_other_format():
+    """Check that a tagged m4a download is named m4a, untagged and kept by verify."""
+    variants = VariantPolicy(formats=["m4a"])
+    rules = RenameRules.load(DEFAULT_RULES_PATH)
+    async with serve_site() as site, open_pipeline(
+        variants=variants, rules=rules
+    ) as pipeline:
+        await main.run_job(
+            pipeline, pipeline.metrics, 1, (f"{site.base_url}/m4a_album", True)
+        )
+        album_path = os.path.join(main.MUSIC_PATH, "Hymns-Music Only")
+        files = sorted(os.listdir(album_path)) if os.path.isdir(album_path) else []
+        filename = os.path.join(album_path, "01 Song 1.m4a")
+        exit_code = run_verify(main.MUSIC_PATH)
+
+        problems = []
+        if files != ["01 Song 1.m4a"]:
+            problems.append(f"files {files}")
+        elif not os.path.isfile(filename):
+            problems.append("m4a track removed by verify")
+        else:
+            with open(filename, "rb") as file:
+                if file.read() != AUDIO:
+                    problems.append("m4a track tagged")
+        if exit_code != 0:
+            problems.append(f"verify exit code {exit_code}")
+        if site.requests != {"/audio/1.m4a": 1}:
+            problems.append(f"requests {site.requests}")
+        return problems
+
+
+CHECKS = [
+    check_failed_download,
+    check_failed_job,
+    check_shared_download,
+    check_verify_relative_path,
+    check_other_format,
+]
+
+
+def check_pipeline():
+    """Run every check, returning the number that failed."""
+    failures = 0
+    for check in CHECKS:
+        problems = asyncio.run(check())
+        if problems:
+            failures += 1
+            print(f"FAIL {check.__name__}: {', '.join(problems)}")
+        else:
+            print(f"OK {check.__name__}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Pipeline checks.",
+        add_help=True,
+    )
+    parser.parse_args()
+
+    sys.exit(1 if check_pipeline() else 0)
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+"""Check the rename rules against the cascade of checks they replaced."""
+import argparse
+import os
+import sys
+import tempfile
+
+from mutagen.id3 import ID3, TRCK
+
+from metadata import read_tags
+from rename_rules import RenameRules
+
+# (path in the music folder, TRCK tag or None)
+FIXTURES = [
+    ("Children's Songbook-Music Only/Heritage/09 Prayer of Thanksgiving.mp3", "90"),
+    ("Children's Songbook-Music Only/Heritage/05 Let the Holy Spirit Guide.mp3", "50"),
+    ("Children's Songbook-Music Only/Nature and Seasons/03 Rain.mp3", "30"),
+    ("Children's Songbook-Music Only/Prelude Music/01 Prelude.mp3", "10"),
+    ("Children's Songbook-Music Only/Other/04 Song.mp3", "40"),
+    ("Children's Songbook-Music Only/07 Prayer of Thanksgiving.mp3", "70"),
+    ("Hymns-Music Only/02 The Spirit of God.mp3", "20"),
+    ("Hymns-Music Only/30 Now Let Us Rejoice.mp3", None),
+    ("Hymns-Music Only/Sacrament/05 Prayer of Thanksgiving.mp3", "50"),
+    ("Hymns-Words and Music/07 I Saw a Mighty Angel Fly.mp3", "70"),
+    ("Hymns-Words and Music/Restoration/07 I Saw a Mighty Angel Fly.mp3", "70"),
+    ("Hymns-Words and Music/12 If You Could Hie to Kolob.mp3", "120"),
+    ("Childrens Songbook-Music Only/Prayer/02 Prayer of Thanksgiving.mp3", "20"),
+    ("Childrens Songbook-Words and Music/Restoration/04 Angel.mp3", "40"),
+    ("Other Album/03 Song.mp3", "30"),
+]
+
+# Titles an album's name index numbers take that number, which the cascade
+# never read. (path in the music folder, TRCK tag, new name)
+INDEX_FIXTURES = [
+    (
+        "Hymns-Music Only/02 Prayer of Thanksgiving.mp3",
+        "20",
+        "093 Prayer of Thanksgiving.mp3",
+    ),
+    (
+        "Childrens Songbook-Words and Music/03 Little Pioneer Children.mp3",
+        "30",
+        "216 Little Pioneer Children.mp3",
+    ),
+]
+
+
+# The cascade from metadata.py before rename_rules.py, kept as it was.
+def get_track_padding(filepath):
+    """Get padding size for track."""
+    three_wide = ["Hymns-Music Only", "Hymns-Words and Music", "Childrens Songbook"]
+
+    for pattern in three_wide:
+        if pattern in filepath:
+            return 3
+
+    return 2
+
+
+def parse_filepath(filepath):
+    """Parse filepath into parts."""
+    filename, _ = os.path.splitext(filepath)
+
+    filename_parts = filename.split("/")
+    album_path = "/".join(filename_parts[:-2]).strip()
+
+    name_parts = filename_parts[-1].split(" ")
+    track_name = " ".join(name_parts[1:]).strip()
+
+    track_no = name_parts[0]
+
+    return (album_path, track_name, track_no)
+
+
+def remove_track_no_trailing_zero(filepath):
+    """Remove track number trailing zero."""
+    _, track_name, track_no = parse_filepath(filepath)
+
+    # Remove trailing zero
+    track_no = track_no[:-1]
+    track_no = int(track_no)
+
+    # Update filename with new track
+    padding_len = get_track_padding(filepath)
+    new_filename = f"{track_no:0{padding_len}d} {track_name}.mp3"
+
+    # update filename only
+    new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
+    return new_filepath
+
+
+def use_tag_track_no(filepath, tags):
+    """Use track tag number."""
+    album_path, track_name, track_no = parse_filepath(filepath)
+
+    track_no = tags.get("TRCK", track_no)
+
+    if "Let the Holy Spirit Guide" in filepath:
+        track_no = "1430"
+
+    if "If You Could Hie to Kolob" in filepath:
+        track_no = "2840"
+
+    if "Words and Music" in album_path:
+        if "I Saw a Mighty Angel Fly" in filepath:
+            track_no = "150"
+
+    if "Music Only" in album_path:
+        if "Prayer of Thanksgiving" in filepath:
+            track_no = "930"
+
+    if "Children's Songbook-Music Only" in album_path:
+        track_no = track_no[:-1]
+        track_no = int(track_no)
+        if "Heritage" in filepath:
+            track_no = track_no + 30
+        if "Nature and Seasons" in filepath:
+            track_no = track_no + 33
+        if "Prelude Music" in filepath:
+            track_no = track_no + 32
+        track_no = f"{track_no:d}0"
+
+    track_no = int(track_no)
+
+    # update file with track no
+    padding_len = get_track_padding(filepath)
+    new_filename = f"{track_no:0{padding_len}d} {track_name}.mp3"
+
+    # update filename only
+    new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
+    return new_filepath
+
+
+def get_old_name(filepath, tags):
+    """Get new name for filepath, as the cascade did."""
+    rename_album_paths = [
+        "Hymns-Words and Music",
+        "Hymns-Music Only",
+        "Childrens Songbook-Music Only",
+        "Children's Songbook-Music Only",
+        "Childrens Songbook-Words and Music",
+    ]
+    for term in rename_album_paths:
+        if term in filepath:
+            new_filepath = use_tag_track_no(filepath, tags)
+            return remove_track_no_trailing_zero(new_filepath)
+
+    return filepath
+
+
+def write_fixture(music_path, path, track_no):
+    """Write an mp3 at path in music_path with a TRCK tag, and return its path."""
+    filepath = os.path.join(music_path, path)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "wb") as file:
+        file.write(b"\xff\xfb\x90\x00" + bytes(413))
+
+    if track_no is not None:
+        tags = ID3()
+        tags.add(TRCK(encoding=3, text=track_no))
+        tags.save(filepath)
+
+    return filepath
+
+
+def check_rules():
+    """Rename every fixture both ways, returning the number that differ."""
+    rules = RenameRules.load()
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix="check_rules_") as music_path:
+        cases = [(path, track_no, None) for path, track_no in FIXTURES]
+        for path, track_no, expected in cases + INDEX_FIXTURES:
+            filepath = write_fixture(music_path, path, track_no)
+            tags = read_tags(filepath)
+            new_name = os.path.basename(rules.get_new_name(filepath, tags))
+            expected = expected or os.path.basename(get_old_name(filepath, tags))
+
+            if new_name != expected:
+                failures += 1
+                print(f"FAIL {path}: {new_name}, expected {expected}")
+            else:
+                print(f"OK {path}: {new_name}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Rename rule checks.",
+        add_help=True,
+    )
+    parser.parse_args()
+
+    sys.exit(1 if check_rules() else 0)
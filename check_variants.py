@@ -0,0 +1,82 @@
+#!/usr/bin/python
+"""Check which download variant each policy picks, and the fallbacks."""
+import argparse
+import sys
+
+from variants import VariantPolicy, get_download_extension
+
+MP3_128 = {"url": "128.mp3", "bitrate": "128", "size": "4000"}
+MP3_64 = {"url": "64.mp3", "bitRate": "64000", "size": "2000"}
+M4A_96 = {"url": "96", "mimeType": "audio/mp4", "kbps": "96 kbps", "size": "3000"}
+OGG = {"url": "track.ogg"}
+DOWNLOADS = [MP3_128, M4A_96, MP3_64, OGG]
+
+# (name, policy options, downloads, url expected or None)
+CASES = [
+    ("no downloads", {}, None, None),
+    ("no urls", {}, [{"size": "100"}, "track.mp3"], None),
+    ("first", {}, DOWNLOADS, "128.mp3"),
+    ("smallest", {"policy": "smallest"}, DOWNLOADS, "64.mp3"),
+    ("format", {"formats": ["m4a"]}, DOWNLOADS, "96"),
+    ("format order", {"formats": ["ogg", "mp3"]}, DOWNLOADS, "track.ogg"),
+    ("missing format falls back", {"formats": ["flac"]}, DOWNLOADS, "128.mp3"),
+    ("bitrate at or under", {"bitrate": 100}, DOWNLOADS, "96"),
+    ("bitrate over", {"bitrate": 32}, [MP3_128, OGG, MP3_64], "64.mp3"),
+    ("bitrate unlisted last", {"bitrate": 32}, [OGG, MP3_128], "128.mp3"),
+    ("max size", {"max_size": 3500}, DOWNLOADS, "96"),
+    (
+        "max size unsized",
+        {"max_size": 1000, "formats": ["ogg"]},
+        DOWNLOADS,
+        "track.ogg",
+    ),
+    ("max size falls back", {"max_size": 1000}, [MP3_128, M4A_96, MP3_64], "64.mp3"),
+    (
+        "max size falls back in format",
+        {"max_size": 1000, "formats": ["mp3"]},
+        [M4A_96, MP3_128],
+        "128.mp3",
+    ),
+]
+
+# (download, extension expected)
+EXTENSIONS = [
+    (MP3_128, "mp3"),
+    (M4A_96, "m4a"),
+    (OGG, "ogg"),
+    ({"url": "stream"}, "mp3"),
+    ({"url": "track", "format": "audio/mpeg"}, "mp3"),
+]
+
+
+def check_variants():
+    """Run every case, returning the number that failed."""
+    failures = 0
+    for name, options, downloads, expected in CASES:
+        download = VariantPolicy(**options).select(downloads)
+        url = download["url"] if download else None
+        if url != expected:
+            failures += 1
+            print(f"FAIL {name}: took {url}, expected {expected}")
+        else:
+            print(f"OK {name}")
+
+    for download, expected in EXTENSIONS:
+        extension = get_download_extension(download)
+        if extension != expected:
+            failures += 1
+            print(f"FAIL extension of {download}: {extension}, expected {expected}")
+        else:
+            print(f"OK extension {extension}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Variant policy checks.",
+        add_help=True,
+    )
+    parser.parse_args()
+
+    sys.exit(1 if check_variants() else 0)
@@ -0,0 +1,292 @@
+"""Fetch pages and stream mp3 files to disk."""
+import asyncio
+import collections
+import hashlib
+import logging
+import re
+
+import aiofiles
+from aiofiles import os as async_os
+import aiohttp
+
+from file_links import link_into_place
+from http_cache import get_validators
+from track_tags import TagRewriter
+
+LOGGER = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+Page = collections.namedtuple("Page", ["url", "status", "text"])
+
+
+async def fetch_url(session, url, headers=None):
+    """Fetch url data."""
+    try:
+        return await session.get(url, headers=headers)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        LOGGER.warning("Connection error occurred while fetching: %s", url)
+
+
+async def fetch_page(session, url, cache=None):
+    """Fetch url and read the body as text."""
+    entry = cache.get(url) if cache else None
+    if entry and cache.is_fresh(entry):
+        return Page(url, entry.status, entry.text)
+
+    if cache and cache.offline:
+        LOGGER.warning("Not in cache: %s", url)
+        return None
+
+    headers = get_validators(entry) if entry else None
+    response = await fetch_url(session, url, headers)
+    if response is None:
+        # Serve a stale copy rather than nothing.
+        return Page(url, entry.status, entry.text) if entry else None
+
+    async with response:
+        if response.status == 304 and entry:
+            cache.refresh(url, response.headers)
+            return Page(url, entry.status, entry.text)
+
+        page = Page(url, response.status, await response.text())
+
+    if cache and page.status == 200:
+        cache.store(url, page.status, page.text, response.headers)
+
+    return page
+
+
+async def get_file_size(filename):
+    """Return the file size or None if it does not exist."""
+    if not await async_os.path.exists(filename):
+        return None
+
+    return (await async_os.stat(filename)).st_size
+
+
+async def get_conditional_headers(entry, filename, temp_filename, resume=True):
+    """Build request headers to revalidate or resume a track.
+
+    Return None when the track is complete and has no validators to check.
+    """
+    if entry is None or entry.path != filename:
+        return {}
+
+    if entry.size is not None and await get_file_size(filename) == entry.size:
+        return get_validators(entry) or None
+
+    # If-Range needs a strong validator.
+    if entry.etag and not entry.etag.startswith("W/"):
+        validator = entry.etag
+    else:
+        validator = entry.last_modified
+
+    offset = await get_file_size(temp_filename) if resume else None
+    if offset and validator:
+        return {"Range": f"bytes={offset}-", "If-Range": validator}
+
+    return {}
+
+
+def get_range_start(content_range):
+    """Return the first byte of a Content-Range header."""
+    match = re.match(r"bytes (\d+)-", content_range or "")
+    if match:
+        return int(match.group(1))
+
+    return None
+
+
+async def hash_file(filename, hasher):
+    """Feed a file's contents to hasher."""
+    async with aiofiles.open(filename, "rb") as file:
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+
+
+async def get_write_mode(response, temp_filename, hasher):
+    """Return the file mode for a response body, or None if it is not a track.
+
+    A partial response continues the temp file, so its bytes are hashed first.
+    """
+    # Error pages served with a 200 status are not tracks either.
+    if response.content_type.startswith("text/"):
+        return None
+
+    if response.status == 200:
+        return "wb"
+
+    if response.status == 206:
+        offset = await get_file_size(temp_filename)
+        if get_range_start(response.headers.get("Content-Range")) != offset:
+            raise ValueError(f"Unexpected range for {response.url}")
+        await hash_file(temp_filename, hasher)
+        return "ab"
+
+    return None
+
+
+async def write_body(  # pylint: disable=too-many-arguments
+    response, filename, mode, hasher, frames=None
+):
+    """Stream a response body to filename, feeding hasher what is written.
+
+    frames, if given, are set in the ID3 tag on the way. Return the number
+    of bytes written.
+    """
+    rewriter = TagRewriter(frames) if frames else None
+    written = 0
+    async with aiofiles.open(filename, mode) as file:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if rewriter:
+                chunk = rewriter.feed(chunk)
+            hasher.update(chunk)
+            await file.write(chunk)
+            written += len(chunk)
+
+        if rewriter:
+            chunk = rewriter.close()
+            hasher.update(chunk)
+            await file.write(chunk)
+            written += len(chunk)
+
+    return written
+
+
+async def move_mp3(store, temp_filename, filename, digest):
+    """Move a finished download into place."""
+    if store:
+        await store.add(temp_filename, digest)
+        await store.link(digest, filename)
+    else:
+        await async_os.replace(temp_filename, filename)
+
+
+async def link_stored_mp3(store, manifest, entry, filename):
+    """Link a track the store already holds.
+
+    Return True when filename needs no download.
+    """
+    if not entry.sha256 or not await store.has(entry.sha256):
+        return False
+
+    if await store.is_linked(entry.sha256, filename):
+        # Only the path the manifest records is revalidated.
+        return entry.path != filename
+
+    await store.link(entry.sha256, filename)
+    manifest.record(
+        entry.url,
+        filename,
+        entry.size,
+        entry.etag,
+        entry.last_modified,
+        entry.sha256,
+    )
+    LOGGER.info("MP3 file linked as: %s", filename)
+    return True
+
+
+async def link_local_mp3(entry, filename):
+    """Link, or copy, the finished file of the same url to filename.
+
+    Return True when filename needs no download.
+    """
+    if entry.size is None or await get_file_size(entry.path) != entry.size:
+        return False
+
+    if await get_file_size(filename) == entry.size:
+        return True
+
+    event_loop = asyncio.get_event_loop()
+    await event_loop.run_in_executor(None, link_into_place, entry.path, filename)
+    LOGGER.info("MP3 file linked as: %s", filename)
+    return True
+
+
+async def link_downloaded_mp3(  # pylint: disable=too-many-arguments
+    store, manifest, entry, filename, frames=None
+):
+    """Link the stored or finished download of the same url to filename.
+
+    Return True when filename needs no download.
+    """
+    # Tagged copies of the same audio differ by album.
+    if frames and entry.path != filename:
+        return False
+
+    if store:
+        return await link_stored_mp3(store, manifest, entry, filename)
+
+    if entry.path != filename:
+        return await link_local_mp3(entry, filename)
+
+    return False
+
+
+async def save_mp3(  # pylint: disable=too-many-arguments,too-many-locals
+    session, url, filename, manifest=None, store=None, frames=None
+):
+    """Save mp3 to local file system, setting the ID3 frames given.
+
+    Return the number of bytes downloaded, 0 when the track needs no
+    download, or None when the fetch fails or the response is not a track.
+    """
+    temp_filename = f"{filename}.part"
+    entry = manifest.get(url) if manifest else None
+    if entry and await link_downloaded_mp3(store, manifest, entry, filename, frames):
+        return 0
+
+    # A tagged partial file no longer lines up with the server's bytes.
+    headers = await get_conditional_headers(
+        entry, filename, temp_filename, resume=not frames
+    )
+    if headers is None:
+        LOGGER.debug("Already downloaded: %s", filename)
+        return 0
+
+    response = await fetch_url(session, url, headers)
+    if response is None:
+        return None
+
+    # Stream into a temp file so a failed download never leaves a partial mp3.
+    hasher = hashlib.sha256()
+    try:
+        async with response:
+            if response.status == 304:
+                LOGGER.debug("Not modified: %s", filename)
+                return 0
+
+            mode = await get_write_mode(response, temp_filename, hasher)
+            if mode is None:
+                LOGGER.error(
+                    "Bad response %s %s for mp3 %s",
+                    response.status,
+                    response.content_type,
+                    url,
+                )
+                return None
+
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if manifest:
+                manifest.record(url, filename, None, etag, last_modified)
+
+            written = await write_body(response, temp_filename, mode, hasher, frames)
+
+        size = await get_file_size(temp_filename)
+        await move_mp3(store, temp_filename, filename, hasher.hexdigest())
+    except BaseException:
+        # Keep the partial file to resume from when the manifest can validate it.
+        if manifest is None and await async_os.path.exists(temp_filename):
+            await async_os.remove(temp_filename)
+        raise
+
+    if manifest:
+        manifest.record(url, filename, size, etag, last_modified, hasher.hexdigest())
+    LOGGER.info("MP3 file saved as: %s", filename)
+    return written
@@ -14,16 +14,20 @@ while getopts ":a" opt; do
 done
 
 
-# Get the URL argument
+# Get the URL arguments
 shift $((OPTIND - 1))
-url=$1
 
-# Perform actions based on the URL and flag
-if [ -n "$url" ]; then
+# Perform actions based on the URLs and flag, crawling all of them in one run
+if [ $# -gt 0 ]; then
+  site_args=()
+  for url in "$@"; do
+    site_args+=(--site_url "$url")
+  done
+
   if [ "$a_flag" = true ]; then
-    python main.py --site_url $url -a
+    python main.py "${site_args[@]}" -a
   else
-    python main.py --site_url $url
+    python main.py "${site_args[@]}"
   fi
 else
   echo "Please provide a valid URL."
@@ -0,0 +1,38 @@
+"""Put links to existing files in place without leaving partial files."""
+import contextlib
+import os
+import shutil
+
+# Suffix of the temp file a link is made at before it replaces the target.
+LINK_SUFFIX = ".link"
+
+
+def symlink_relative(source, link_path):
+    """Symlink link_path to source by a path relative to link_path's folder."""
+    os.symlink(os.path.relpath(source, os.path.dirname(link_path)), link_path)
+
+
+def link_into_place(source, filename, fallback=shutil.copyfile, hardlink=True):
+    """Hardlink source as filename, or use fallback(source, path) instead.
+
+    The link is made next to filename and then replaces it, so filename is
+    never missing or partial. fallback is used when hardlinks are off or the
+    filesystem refuses one, such as across filesystems. Return True when
+    filename is a hardlink.
+    """
+    temp_path = f"{filename}{LINK_SUFFIX}"
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(temp_path)
+
+    linked = False
+    if hardlink:
+        try:
+            os.link(source, temp_path)
+            linked = True
+        except OSError:
+            pass
+    if not linked:
+        fallback(source, temp_path)
+
+    os.replace(temp_path, filename)
+    return linked
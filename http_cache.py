@@ -0,0 +1,169 @@
+"""On-disk cache for page and collection api responses."""
+import collections
+import re
+import sqlite3
+import time
+
+# Pages without Cache-Control are revalidated with ETag or Last-Modified on
+# every run, so refresh runs see new tracks.
+DEFAULT_TTL = 0
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+CacheEntry = collections.namedtuple(
+    "CacheEntry", ["url", "status", "text", "etag", "last_modified", "expires"]
+)
+
+
+def parse_cache_control(value):
+    """Parse a Cache-Control header into a dict of directives."""
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"')
+
+    return directives
+
+
+def get_expires(headers, ttl):
+    """Return when a response goes stale, or None if it must not be stored."""
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if "no-store" in directives:
+        return None
+
+    if "no-cache" in directives:
+        return time.time()
+
+    max_age = directives.get("max-age", "")
+    if re.fullmatch(r"\d+", max_age):
+        return time.time() + int(max_age)
+
+    return time.time() + ttl
+
+
+def get_validators(entry):
+    """Return conditional request headers for an entry with etag/last_modified."""
+    headers = {}
+    if entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    return headers
+
+
+class HttpCache:
+    """Url keyed response cache with a ttl and least recently used eviction."""
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, offline=False):
+        """Open or create the cache database."""
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                status INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires REAL NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.connection.commit()
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, url):
+        """Return the cached entry for url or None."""
+        row = self.connection.execute(
+            """
+            SELECT url, status, text, etag, last_modified, expires
+            FROM responses WHERE url = ?
+            """,
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        self.connection.execute(
+            "UPDATE responses SET accessed = ? WHERE url = ?", (time.time(), url)
+        )
+        self.connection.commit()
+        return CacheEntry(*row)
+
+    def is_fresh(self, entry):
+        """Check if entry can be used without asking the site."""
+        return self.offline or entry.expires > time.time()
+
+    def store(self, url, status, text, headers):
+        """Cache a response unless its headers forbid it."""
+        expires = get_expires(headers, self.ttl)
+        if expires is None:
+            return
+
+        size = len(text.encode("utf-8"))
+        previous = self.connection.execute(
+            "SELECT size FROM responses WHERE url = ?", (url,)
+        ).fetchone()
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO responses
+                (url, status, text, etag, last_modified, expires, size, accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                url,
+                status,
+                text,
+                headers.get("ETag"),
+                headers.get("Last-Modified"),
+                expires,
+                size,
+                time.time(),
+            ),
+        )
+        self.connection.commit()
+        self.size += size - (previous[0] if previous else 0)
+        self.evict()
+
+    def refresh(self, url, headers):
+        """Extend a cached entry after the site answered 304 Not Modified."""
+        expires = get_expires(headers, self.ttl)
+        if expires is None:
+            expires = time.time()
+
+        self.connection.execute(
+            "UPDATE responses SET expires = ?, accessed = ? WHERE url = ?",
+            (expires, time.time(), url),
+        )
+        self.connection.commit()
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits max_size."""
+        while self.size > self.max_size:
+            row = self.connection.execute(
+                "SELECT url, size FROM responses ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self.size = 0
+                break
+
+            self.connection.execute("DELETE FROM responses WHERE url = ?", (row[0],))
+            self.size -= row[1]
+
+        self.connection.commit()
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
@@ -2,29 +2,90 @@
 """Main script for scraper."""
 import argparse
 import asyncio
+import concurrent.futures
+import contextlib
+import functools
 import json
 import logging
+import logging.handlers
+import multiprocessing
 import os
-import re
+import queue
 import sys
-import urllib.parse
+import time
 
 from aiofiles import os as async_os
 import aiohttp
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
+from catalog import Catalog
+from download import fetch_page, get_file_size, save_mp3
+from http_cache import DEFAULT_TTL, HttpCache
+from manifest import Manifest
+from metrics import Metrics
+from page_parser import (
+    clean_name,
+    join_url,
+    parse_album_page,
+    parse_collection_page,
+    parse_track_page,
+)
+from plan import (
+    Track,
+    parse_shard,
+    parse_url_line,
+    read_plan,
+    read_url_file,
+    write_plan_track,
+)
+from rename_rules import DEFAULT_RULES_PATH, RenameRules
+from scheduler import POLICIES, DownloadScheduler
+from shared_downloads import SharedDownloads
+from single_flight import SingleFlight
+from throttle import AdaptiveLimiter, ThrottledSession
+from track_store import TrackStore
+from track_tags import get_track_frames
+from variants import (
+    POLICIES as VARIANT_POLICIES,
+    VariantPolicy,
+    get_download_extension,
+    get_download_size,
+    get_variant_label,
+)
+from worker import JobWorker
+
 load_dotenv()
 
-logging.basicConfig(
-    format="%(asctime)s %(levelname)s:%(name)s: %(message)s",
-    level=logging.DEBUG,
-    datefmt="%H:%M:%S",
-    stream=sys.stderr,
-)
 LOGGER = logging.getLogger(__name__)
 logging.getLogger("chardet.charsetprober").disabled = True
 
+# Seconds to keep resolved hosts, so worker jobs skip the DNS lookup.
+DNS_CACHE_TTL = 300
+
+
+def setup_logging(level="INFO", log_file=None):
+    """Send log records through a queue to a thread that writes them.
+
+    Return the listener so it can be stopped to flush records at exit.
+    """
+    if log_file:
+        handler = logging.FileHandler(log_file, encoding="utf-8")
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s %(levelname)s:%(name)s: %(message)s", datefmt="%H:%M:%S"
+        )
+    )
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
+
 
 def get_music_folder():
     """Return the full path."""
@@ -36,6 +97,26 @@ def get_music_folder():
     return os.path.join(current_dir, path)
 
 
+def get_manifest_path():
+    """Return the default download manifest path."""
+    return os.path.join(get_music_folder(), ".manifest.sqlite")
+
+
+def get_store_path():
+    """Return the content addressed track store path."""
+    return os.path.join(get_music_folder(), ".store")
+
+
+def get_catalog_path():
+    """Return the default track catalog path."""
+    return os.path.join(get_music_folder(), ".catalog.sqlite")
+
+
+def get_cache_path():
+    """Return the default page cache path."""
+    return os.path.join(get_music_folder(), ".cache.sqlite")
+
+
 async def create_music_folder():
     """Create post folder."""
     folder_name = get_music_folder()
@@ -75,24 +156,11 @@ async def create_album_folder(album_title, collection_title=None):
         LOGGER.info("Folder already exists:  %s", folder_name)
 
 
-def clean_name(name):
-    """Ensure title is a valid name."""
-    name = name.replace("<em>", "")
-    name = name.replace("—", "-")
-    name = name.replace("–", "-")
-    name = name.replace("‘", "'")
-    name = name.replace("’", "'")
-    # track_title = track_title.replace("?","")
-    # track_title = track_title.replace("!","")
-    name = re.sub(r"[^a-zA-Z0-9\s\.\-\']", "", name)
-    name = name.replace("  ", " ")
-    name = name.replace("  ", " ")
-    return name
-
-
-def get_full_file_name(album_title, track_title, track_no, collection_title=None):
+def get_full_file_name(
+    album_title, track_title, track_no, collection_title=None, extension="mp3"
+):
     """Get full path for track."""
-    filename = f"{track_no:02d} {track_title}.mp3"
+    filename = f"{track_no:02d} {track_title}.{extension}"
     if collection_title:
         file_path = os.path.join(
             get_music_folder(), collection_title, album_title, filename
@@ -103,94 +171,272 @@ def get_full_file_name(album_title, track_title, track_no, collection_title=None
     return file_path
 
 
-async def fetch_url(session, url):
-    """Fetch url data."""
-    try:
-        return await session.get(url)
-    except aiohttp.ClientConnectionError:
-        print(f"Connection error occurred while fetching: {url}")
-
-
-async def save_mp3(session, url, filename):
-    """Save mp3 to local file system."""
-    response = await fetch_url(session, url)
-    if response is None:
-        return
-
-    mp3_data = await response.read()
-    with open(filename, "wb") as file:
-        file.write(mp3_data)
-    print(f"MP3 file saved as: {filename}")
-
-
-def join_url(base_url, link):
-    """Join base url with relative link."""
-    parsed_original = urllib.parse.urlparse(base_url)
-    joined_link = urllib.parse.urljoin(
-        parsed_original.scheme + "://" + parsed_original.netloc, link
+def get_track_file_name(track):
+    """Get full path for a Track."""
+    return get_full_file_name(
+        track.album_title,
+        track.track_title,
+        track.track_no,
+        track.collection_title,
+        track.extension or "mp3",
     )
-    return joined_link
-
-
-def has_album_detail(div_element):
-    """Check if element has album info."""
-    if len(div_element.contents) != 2:
-        return False
-
-    child1 = div_element.contents[0]
-    child2 = div_element.contents[1]
 
-    # Check if both children are divs
-    if child1.name != "div" or child2.name != "div":
-        return False
 
-    # Check if second is only text in div
-    if child2.contents and not isinstance(child2.contents[0], str):
-        return False
+def get_track_download(track, rules=None):
+    """Get the path and ID3 frames to download a Track with.
 
-    return True
+    With rules, an mp3 track is named and tagged with its final number, as
+    metadata.py would rename it. Without, or for other formats, which take no
+    ID3 tag, it is not tagged and metadata.py renames it later.
+    """
+    filename = get_track_file_name(track)
+    if rules is None or not filename.endswith(".mp3"):
+        return filename, None
 
+    filename, track_no = rules.get_download_name(filename, track.track_no)
+    frames = get_track_frames(
+        track.collection_title, track.album_title, track.track_title, track_no
+    )
+    return filename, frames
+
+
+class Pipeline:  # pylint: disable=too-many-instance-attributes
+    """Crawl pipeline linking page fetch, parse and download workers.
+
+    The page queue only holds urls found while parsing, so it is unbounded to
+    keep parse workers from waiting on fetch workers that wait on them. The
+    parse queue holds page bodies and the download queue holds tracks, so both
+    are bounded to cap memory and push back on the stage feeding them. Tracks
+    leave the download queue in the order of the scheduling policy.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        session,
+        page_workers=4,
+        parse_workers=2,
+        download_workers=8,
+        queue_size=16,
+        manifest=None,
+        cache=None,
+        executor=None,
+        store=None,
+        plan_file=None,
+        metrics=None,
+        rules=None,
+        policy="album",
+        variants=None,
+        catalog=None,
+    ):
+        """Initialize the stage queues."""
+        self.session = session
+        self.metrics = metrics or Metrics()
+        self.manifest = manifest
+        self.cache = cache
+        self.executor = executor
+        self.store = store
+        self.plan_file = plan_file
+        self.rules = rules
+        self.variants = variants or VariantPolicy()
+        self.catalog = catalog
+        self.page_flights = SingleFlight()
+        self.downloads = SharedDownloads(self._save_track, self.metrics)
+        self.page_workers = page_workers
+        self.parse_workers = parse_workers
+        self.download_workers = download_workers
+        self.page_queue = asyncio.Queue()
+        self.parse_queue = asyncio.Queue(maxsize=queue_size)
+        self.download_queue = DownloadScheduler(policy, maxsize=queue_size)
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def _add_pending(self):
+        """Track a new work item."""
+        self._pending += 1
+        self._idle.clear()
+
+    def _done_pending(self):
+        """Mark a work item as finished."""
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    def _sample_queues(self):
+        """Record the depth of each stage queue."""
+        self.metrics.gauge("page_queue", self.page_queue.qsize())
+        self.metrics.gauge("parse_queue", self.parse_queue.qsize())
+        self.metrics.gauge("download_queue", self.download_queue.qsize())
+
+    async def add_page(self, url, handler, *handler_args):
+        """Queue a page to fetch and pass to handler."""
+        self._add_pending()
+        await self.page_queue.put((url, handler, handler_args))
+        self._sample_queues()
+
+    async def add_download(self, track):
+        """Queue a track to download."""
+        self._add_pending()
+        self.metrics.album_queued((track.collection_title, track.album_title))
+        await self.download_queue.put(track)
+        self._sample_queues()
+
+    async def parse(self, parse_func, text):
+        """Run a page parser in the executor, or inline without one."""
+        started = time.monotonic()
+        try:
+            if self.executor is None:
+                return parse_func(text)
+
+            event_loop = asyncio.get_event_loop()
+            return await event_loop.run_in_executor(self.executor, parse_func, text)
+        finally:
+            self.metrics.observe("parse", time.monotonic() - started)
+
+    async def fetch_page(self, url):
+        """Fetch a page, sharing the fetch of a worker already getting url."""
+        if self.page_flights.is_running(url):
+            self.metrics.count("pages_coalesced")
+
+        return await self.page_flights.run(
+            url, fetch_page, self.session, url, self.cache
+        )
 
-def get_collection_id(soup):
-    """Return the collection id for the page."""
-    anchor_tags = soup.find_all("a")
-    for anchor_tag in anchor_tags:
-        href = anchor_tag.get("href")
-        if href:
-            parsed_url = urllib.parse.urlparse(href)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
-            if "collectionId" in query_params:
-                collection_id = query_params["collectionId"][0]
-                return collection_id
-
-    return None
-
-
-def get_album_links(soup):
-    """Get album links from site."""
-    album_links = []
-
-    div_album_collection = soup.find("div", attrs={"data-testid": "CollectionGridView"})
-    for a_tag in div_album_collection.find_all("a"):
-        for a_div in a_tag.find_all("div"):
-            if has_album_detail(a_div):
-                # Get the first two child divs
-                child_divs = a_div.find_all("div", recursive=False)
-                album_track_count = child_divs[0].text.strip()
-                album_title = child_divs[1].text.strip()
-
-                album_links.append((album_title, album_track_count, a_tag["href"]))
+    async def _save_track(self, track, filename, frames):
+        """Save a track, returning its filename and the bytes downloaded."""
+        downloaded = await save_mp3(
+            self.session, track.audio_src, filename, self.manifest, self.store, frames
+        )
+        if self.manifest and track.variant:
+            self.manifest.set_variant(track.audio_src, track.variant)
+        return filename, downloaded
+
+    async def add_to_catalog(self, track, filename, frames=None):
+        """Record a track saved at filename in the catalog, if there is one."""
+        if self.catalog is None:
+            return
+
+        # Failed downloads leave no file to catalog.
+        size = await get_file_size(filename)
+        if size is not None:
+            self.catalog.record(filename, track, size, tagged=frames is not None)
+
+    async def _page_worker(self):
+        """Fetch pages and hand them to the parse stage."""
+        while True:
+            url, handler, handler_args = await self.page_queue.get()
+            page = None
+            started = time.monotonic()
+            try:
+                page = await self.fetch_page(url)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Failed to fetch %s", url)
+            self.metrics.observe("fetch", time.monotonic() - started)
+
+            if page is None:
+                self.metrics.count("page_errors")
+                self._done_pending()
+            else:
+                self.metrics.count("pages")
+                self.metrics.count("page_bytes", len(page.text))
+                await self.parse_queue.put((page, handler, handler_args))
+            self._sample_queues()
+
+    async def _parse_worker(self):
+        """Parse pages, queueing new pages and downloads."""
+        while True:
+            page, handler, handler_args = await self.parse_queue.get()
+            self._sample_queues()
+            try:
+                await handler(self, page, *handler_args)
+            except Exception:  # pylint: disable=broad-except
+                self.metrics.count("parse_errors")
+                LOGGER.exception("Failed to parse %s", page.url)
+            finally:
+                self._done_pending()
+
+    async def _download_worker(self):
+        """Download queued tracks, or write them to the plan file."""
+        while True:
+            track = await self.download_queue.get()
+            self._sample_queues()
+            started = time.monotonic()
+            try:
+                if self.plan_file:
+                    write_plan_track(self.plan_file, track)
+                else:
+                    filename, frames = get_track_download(track, self.rules)
+                    await async_os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    downloaded = await self.downloads.download(track, filename, frames)
+                    await self.add_to_catalog(track, filename, frames)
+                    self.metrics.observe("download", time.monotonic() - started)
+                    if downloaded is None:
+                        self.metrics.count("download_errors")
+                    else:
+                        self.metrics.count("bytes", downloaded)
+                        self.metrics.count(
+                            "tracks_downloaded" if downloaded else "tracks_skipped"
+                        )
+            except Exception:  # pylint: disable=broad-except
+                self.metrics.count("download_errors")
+                LOGGER.exception("Failed to download %s", track.audio_src)
+            finally:
+                self.metrics.album_track_done(
+                    (track.collection_title, track.album_title)
+                )
+                self._done_pending()
+
+    async def run(self, seed):
+        """Run the workers until seed and every item it queued are handled."""
+        workers = [
+            asyncio.ensure_future(self._page_worker()) for _ in range(self.page_workers)
+        ]
+        workers += [
+            asyncio.ensure_future(self._parse_worker())
+            for _ in range(self.parse_workers)
+        ]
+        workers += [
+            asyncio.ensure_future(self._download_worker())
+            for _ in range(self.download_workers)
+        ]
+
+        try:
+            # Seed once workers run so a full download queue can drain.
+            await seed
+            await self._idle.wait()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def add_item_download(
+    pipeline, item, track_no, album_title, collection_title=None
+):
+    """Queue the download variant of an album item the pipeline's policy picks."""
+    download = pipeline.variants.select(item.get("downloads"))
+    if download is None:
+        LOGGER.warning("No download for %s in %s", item.get("title"), album_title)
+        return
 
-    return album_links
+    await pipeline.add_download(
+        Track(
+            collection_title,
+            album_title,
+            track_no,
+            clean_name(item["title"].strip()),
+            download["url"],
+            get_download_size(download),
+            get_variant_label(download),
+            item.get("id"),
+            get_download_extension(download),
+        )
+    )
 
 
-async def scrape_album_json(session, soup, collection_title=None):
+async def scrape_album_json(pipeline, json_data, collection_title=None):
     """Scrape the album site's json data."""
-    if soup.find("script", attrs={"type": "application/json"}):
-
-        json_data = json.loads(
-            soup.find("script", attrs={"type": "application/json"}).string
-        )
+    if json_data is not None:
 
         if "err" in json_data:
             raise LookupError("This item is not available for download.")
@@ -198,39 +444,25 @@ async def scrape_album_json(session, soup, collection_title=None):
         album_title = clean_name(json_data["props"]["pageProps"]["title"].strip())
         await create_album_folder(album_title, collection_title)
 
-        tasks = []
         for idx, item in enumerate(json_data["props"]["pageProps"].get("items", [])):
-            track_title = clean_name(item["title"].strip())
-            audio_src = item["downloads"][0].get("url")
-            full_file_name = get_full_file_name(
-                album_title, track_title, idx + 1, collection_title
+            await add_item_download(
+                pipeline, item, idx + 1, album_title, collection_title
             )
-
-            tasks.append(save_mp3(session, audio_src, full_file_name))
-
-        await asyncio.gather(*tasks)
     else:
         raise LookupError("Json data not found on the page.")
 
 
-async def scrape_album_html(session, url, soup, collection_title=None):
+async def scrape_album_html(pipeline, url, album, collection_title=None):
     """Get Album details from site."""
-    album_title = await create_album_folder_from_page(soup, collection_title)
-
-    div_track_collection = soup.find("div", attrs={"data-testid": "CollectionListView"})
-    a_tags = div_track_collection.find_all("a", recursive=False)
+    album_title = clean_name(album.title.strip())
+    await create_album_folder(album_title, collection_title)
 
-    tasks = []
-    for idx, item in enumerate(a_tags):
-        track_url = join_url(url, item["href"])
-        tasks.append(
-            scrape_child_page(
-                session, track_url, album_title, idx + 1, collection_title
-            )
+    for idx, href in enumerate(album.track_links):
+        track_url = join_url(url, href)
+        await pipeline.add_page(
+            track_url, scrape_child_page, album_title, idx + 1, collection_title
         )
 
-    await asyncio.gather(*tasks)
-
 
 def get_collection_url(collection_id, base_url):
     """Get collection full url."""
@@ -239,139 +471,84 @@ def get_collection_url(collection_id, base_url):
     return full_url
 
 
-async def create_album_folder_from_page(soup, collection_title):
-    """Create album folder from page."""
-    header = soup.find("header")
-    h1_title = header.find("h1", recursive=False)
-    album_title = clean_name(h1_title.text.strip())
-    await create_album_folder(album_title, collection_title)
-    return album_title
-
-
-async def save_collection_files(session, collection_url, album_title, collection_title):
+async def save_collection_files(pipeline, page, album_title, collection_title):
     """Save all files for the collection_id."""
-    response = await fetch_url(session, collection_url)
-    if response.status == 200:
-        json_data = await response.json()
+    if page.status == 200:
+        json_data = json.loads(page.text)
 
         if "err" in json_data:
             raise LookupError("This item is not available for download.")
 
         if "items" in json_data:
-            tasks = []
             for idx, item in enumerate(json_data["items"]):
-
-                track_title = clean_name(item["title"].strip())
-                audio_src = item["downloads"][0].get("url")
-                full_file_name = get_full_file_name(
-                    album_title, track_title, idx + 1, collection_title
+                await add_item_download(
+                    pipeline, item, idx + 1, album_title, collection_title
                 )
-
-                tasks.append(save_mp3(session, audio_src, full_file_name))
-
-            await asyncio.gather(*tasks)
         else:
             raise LookupError("No items in the data data not found on the page.")
     else:
-        response_text = await response.text()
         LOGGER.error(
             "Bad response for collection '%s' and album '%s'. '%s' for url '%s'",
             collection_title,
             album_title,
-            response_text,
-            collection_url,
+            page.text,
+            page.url,
         )
 
 
-async def scrape_album_api(session, url, soup, collection_title):
+async def scrape_album_api(pipeline, url, album, collection_title):
     """Fetch tracks by the api."""
-    album_title = await create_album_folder_from_page(soup, collection_title)
+    album_title = clean_name(album.title.strip())
+    await create_album_folder(album_title, collection_title)
 
     # Get items by api call
-    collection_id = get_collection_id(soup)
-    collection_url = get_collection_url(collection_id, url)
-    await save_collection_files(session, collection_url, album_title, collection_title)
+    collection_url = get_collection_url(album.collection_id, url)
+    await pipeline.add_page(
+        collection_url, save_collection_files, album_title, collection_title
+    )
 
 
-async def scrape_child_page(session, url, album_title, track_no, collection_title=None):
+async def scrape_child_page(
+    pipeline, page, album_title, track_no, collection_title=None
+):
     """Parse and save track."""
-    html = await fetch_url(session, url)
-    if html is None:
-        return
-
-    soup = BeautifulSoup(await html.text(), "html.parser")
+    track = await pipeline.parse(parse_track_page, page.text)
 
-    # Look for track_title
-    track_title = None
-    div_elements = soup.find_all("div")
-    for div in div_elements:
-        # Check if the div contains an h1, button, and section
-        if div.find("h1") and div.find("button") and div.find("section"):
-            track_title = clean_name(div.find("h1").text.strip())
+    track_title = clean_name(track.title.strip()) if track.title else None
+    audio_src = track.audio_src
 
-    # get audio link
-    audio_src = None
-    audio_tag = soup.find("audio")
-    if audio_tag and audio_tag.has_attr("src"):
-        audio_src = audio_tag["src"]
-
-    tasks = []
     if track_title and audio_src:
-        full_file_name = get_full_file_name(
-            album_title, track_title, track_no, collection_title
+        await pipeline.add_download(
+            Track(collection_title, album_title, track_no, track_title, audio_src, None)
         )
-        tasks.append(save_mp3(session, audio_src, full_file_name))
-
-    await asyncio.gather(*tasks)
-
 
-def has_json_data(soup):
-    """Check if page has json data."""
-    # Search for the text 'mp3' or 'pageProps' in script tags
-    script_tags = soup.find_all("script")
-    for script_tag in script_tags:
-        script_text = script_tag.get_text()
-        if "mp3" in script_text or "pageProps" in script_text:
-            return True
 
-    return False
-
-
-async def scrape_album_site(session, url, collection_title=None):
+async def scrape_album_site(pipeline, page, collection_title=None):
     """Scrape the album site following urls."""
-    html = await fetch_url(session, url)
-    if html is None:
-        return
-
-    soup = BeautifulSoup(await html.text(), "html.parser")
+    album = await pipeline.parse(parse_album_page, page.text)
 
     try:
-        if get_collection_id(soup):
+        if album.collection_id:
             # Try to call json directly
-            await scrape_album_api(session, url, soup, collection_title)
+            await scrape_album_api(pipeline, page.url, album, collection_title)
 
-        elif has_json_data(soup):
+        elif album.has_json:
             # Try to call json directly
-            await scrape_album_json(session, soup, collection_title)
+            await scrape_album_json(pipeline, album.json_data, collection_title)
 
         else:
-            await scrape_album_html(session, url, soup, collection_title)
+            await scrape_album_html(pipeline, page.url, album, collection_title)
     except LookupError:
-        LOGGER.error("Failed to parse Album %s", url)
+        LOGGER.error("Failed to parse Album %s", page.url)
 
 
-async def scrape_collection_api(session, url, soup, collection_title):
+async def scrape_collection_api(pipeline, url, json_data, collection_title):
     """Use the api to fetch collection files."""
-    if soup.find("script", attrs={"type": "application/json"}):
-
-        json_data = json.loads(
-            soup.find("script", attrs={"type": "application/json"}).string
-        )
+    if json_data is not None:
 
         if "err" in json_data:
             raise LookupError("This collection is not available for download.")
 
-        tasks = []
         for _, item in enumerate(json_data["props"]["pageProps"].get("items", [])):
 
             album_title = clean_name(item["title"].strip())
@@ -380,58 +557,171 @@ async def scrape_collection_api(session, url, soup, collection_title):
             collection_id = item["id"].strip()
 
             collection_url = get_collection_url(collection_id, url)
-            tasks.append(
-                save_collection_files(
-                    session, collection_url, album_title, collection_title
-                )
+            await pipeline.add_page(
+                collection_url, save_collection_files, album_title, collection_title
             )
-
-        await asyncio.gather(*tasks)
     else:
         raise LookupError("Json data not found on the page.")
 
 
-async def scrape_collection_site(session, url):
+async def scrape_collection_site(pipeline, page):
     """Scrape the music site following urls."""
-    tasks = []
+    collection = await pipeline.parse(parse_collection_page, page.text)
 
-    html = await fetch_url(session, url)
-    if html is None:
-        return
-
-    soup = BeautifulSoup(await html.text(), "html.parser")
-
-    h1_title = soup.find("h1")
-    collection_title = clean_name(h1_title.text.strip())
+    collection_title = clean_name(collection.title.strip())
     await create_folder(collection_title)
 
     # Check if collection has collection_ids
-    if has_json_data(soup):
-        await scrape_collection_api(session, url, soup, collection_title)
+    if collection.has_json:
+        await scrape_collection_api(
+            pipeline, page.url, collection.json_data, collection_title
+        )
     else:
-        album_links = get_album_links(soup)
-
-        for album_link in album_links:
+        for album_link in collection.album_links:
             album_title, album_track_count, link = album_link
 
             LOGGER.info(
                 "Parsing Album: %s %s at %s", album_title, album_track_count, link
             )
-            joined_link = join_url(url, link)
-            tasks.append(scrape_album_site(session, joined_link, collection_title))
+            joined_link = join_url(page.url, link)
+            await pipeline.add_page(joined_link, scrape_album_site, collection_title)
+
+
+async def seed_urls(pipeline, urls):
+    """Queue (url, is_album) site urls to crawl."""
+    for url, is_album in urls:
+        if is_album:
+            await pipeline.add_page(url, scrape_album_site)
+        else:
+            await pipeline.add_page(url, scrape_collection_site)
+
+
+async def seed_pipeline(pipeline):
+    """Queue the tracks of the plan to execute, or the site urls to crawl."""
+    if EXECUTE_PATH:
+        for track in read_plan(EXECUTE_PATH, SHARD):
+            await pipeline.add_download(track)
+        return
 
-        await asyncio.gather(*tasks)
+    await seed_urls(pipeline, SITE_URLS)
+
+
+async def run_job(pipeline, metrics, job_id, entry):
+    """Crawl one (url, is_album) worker job and return its status."""
+    url, is_album = entry
+    before = dict(metrics.counters)
+    started = time.monotonic()
+    await pipeline.run(seed_urls(pipeline, [entry]))
+    counters = {
+        name: value - before.get(name, 0)
+        for name, value in metrics.counters.items()
+        if value != before.get(name, 0)
+    }
+    errors = sum(value for name, value in counters.items() if name.endswith("errors"))
+    return {
+        "job": job_id,
+        "url": url,
+        "album": is_album,
+        "status": "errors" if errors else "done",
+        "seconds": round(time.monotonic() - started, 3),
+        "counters": counters,
+    }
+
+
+def write_metrics(metrics):
+    """Write the run metrics as json to METRICS_PATH, or log them."""
+    summary = metrics.summary()
+    if METRICS_PATH:
+        with open(METRICS_PATH, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+    else:
+        LOGGER.info("Run metrics: %s", json.dumps(summary))
 
 
 async def main():
     """Fetch main data."""
     await create_music_folder()
 
-    async with aiohttp.ClientSession() as session:
-        if IS_ALBUM:
-            await scrape_album_site(session, SITE_URL)
-        else:
-            await scrape_collection_site(session, SITE_URL)
+    metrics = Metrics()
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await metrics.serve(METRICS_PORT)
+
+    try:
+        await crawl(metrics)
+    finally:
+        write_metrics(metrics)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+
+async def crawl(metrics):
+    """Crawl the site urls, or execute a plan, recording metrics."""
+    with contextlib.ExitStack() as stack:
+        executor = None
+        if not INLINE_PARSE:
+            # Forked parse processes would hold worker job connections open.
+            context = multiprocessing.get_context("forkserver" if WORKER else None)
+            executor = concurrent.futures.ProcessPoolExecutor(
+                PARSE_WORKERS, mp_context=context
+            )
+            stack.callback(executor.shutdown)
+
+        manifest = Manifest(MANIFEST_PATH or get_manifest_path())
+        stack.callback(manifest.close)
+        cache = HttpCache(
+            CACHE_PATH or get_cache_path(),
+            ttl=CACHE_TTL,
+            max_size=CACHE_SIZE * 1024 * 1024,
+            offline=OFFLINE,
+        )
+        stack.callback(cache.close)
+        catalog = Catalog(CATALOG_PATH or get_catalog_path(), get_music_folder())
+        stack.callback(catalog.close)
+
+        plan_file = None
+        if PLAN_PATH:
+            plan_file = stack.enter_context(open(PLAN_PATH, "w", encoding="utf-8"))
+
+        connector = aiohttp.TCPConnector(ttl_dns_cache=DNS_CACHE_TTL)
+        async with aiohttp.ClientSession(connector=connector) as client_session:
+            limiter = AdaptiveLimiter(CONCURRENCY, maximum=MAX_CONCURRENCY)
+            session = ThrottledSession(
+                client_session,
+                limiter,
+                retries=RETRIES,
+                backoff=BACKOFF,
+                metrics=metrics,
+            )
+            pipeline = Pipeline(
+                session,
+                page_workers=PAGE_WORKERS,
+                parse_workers=PARSE_WORKERS,
+                download_workers=DOWNLOAD_WORKERS,
+                queue_size=QUEUE_SIZE,
+                manifest=manifest,
+                cache=cache,
+                executor=executor,
+                store=TrackStore(get_store_path(), SYMLINK) if STORE else None,
+                plan_file=plan_file,
+                metrics=metrics,
+                rules=RenameRules.load(RULES_PATH) if TAG else None,
+                policy=SCHEDULE,
+                variants=VariantPolicy(
+                    VARIANT,
+                    FORMATS,
+                    BITRATE,
+                    MAX_TRACK_SIZE * 1024 * 1024 if MAX_TRACK_SIZE else None,
+                ),
+                catalog=catalog,
+            )
+            if WORKER:
+                worker = JobWorker(
+                    functools.partial(run_job, pipeline, metrics), parse_url_line
+                )
+                await worker.serve(WORKER_SOCKET)
+            else:
+                await pipeline.run(seed_pipeline(pipeline))
 
 
 if __name__ == "__main__":
@@ -442,26 +732,244 @@ if __name__ == "__main__":
     parser.add_argument(
         "--site_url",
         "-s",
-        help="Site URL to scrape",
+        action="append",
+        help="Site URL to scrape. Repeat to crawl several in one run.",
+    )
+    parser.add_argument(
+        "--url_file",
+        "-f",
+        help="File with one URL per line. Prefix album URLs with -a.",
     )
     parser.add_argument(
         "--music_path",
         "-m",
         help="Path to music folder",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Requests in flight to start with. Adjusts to the site's response.",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=64,
+        help="Most requests in flight.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries for connection errors, timeouts and throttled responses.",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=0.5,
+        help="Base seconds for the jittered exponential retry delay.",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Path to the download manifest. Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--catalog",
+        help="Path to the catalog of downloaded tracks metadata.py reads. "
+        "Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--plan",
+        help="Crawl only and write every track to this plan file.",
+    )
+    parser.add_argument(
+        "--execute",
+        help="Download the tracks of a plan file instead of crawling.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="Only download albums of shard i/N of the plan, with 0 <= i < N.",
+    )
+    parser.add_argument(
+        "--store",
+        action="store_true",
+        help="Keep each track once in MUSIC_PATH/.store and link it into albums.",
+    )
+    parser.add_argument(
+        "--symlink",
+        action="store_true",
+        help="Link stored tracks with symlinks instead of hardlinks.",
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Keep running and crawl `[-a] url` jobs read from stdin, one per "
+        "line, printing each job's status as json.",
+    )
+    parser.add_argument(
+        "--socket",
+        help="With --worker, take jobs from connections to this Unix socket "
+        "instead of stdin.",
+    )
+    parser.add_argument(
+        "--tag",
+        action="store_true",
+        help="Write ID3 tags and final track numbers while downloading.",
+    )
+    parser.add_argument(
+        "--rules",
+        default=DEFAULT_RULES_PATH,
+        help="Rename rules for --tag. Defaults to rename_rules.json.",
+    )
+    parser.add_argument(
+        "--cache",
+        help="Path to the page cache. Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--cache_ttl",
+        type=int,
+        default=DEFAULT_TTL,
+        help="Seconds to reuse a cached page without Cache-Control instead of "
+        "revalidating it. Defaults to revalidating every time.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=256,
+        help="Max size of the page cache in MB.",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Only use cached pages.",
+    )
     parser.add_argument(
         "-a",
         action="store_true",
-        help="Url path is an album.",
+        help="Url paths given with --site_url are albums.",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write the run metrics as json to this file at exit.",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="Serve Prometheus text metrics on localhost:PORT/metrics.",
+    )
+    parser.add_argument(
+        "--log_level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Lowest level to log.",
+    )
+    parser.add_argument(
+        "--log_file",
+        help="Log to this file instead of stderr.",
+    )
+    parser.add_argument(
+        "--page_workers",
+        type=int,
+        default=4,
+        help="Number of concurrent page fetches.",
+    )
+    parser.add_argument(
+        "--parse_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of page parser processes.",
+    )
+    parser.add_argument(
+        "--inline_parse",
+        action="store_true",
+        help="Parse pages on the event loop instead of in parser processes.",
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        help="Most concurrent mp3 downloads. Defaults to --max_concurrency, so the "
+        "adaptive concurrency limit decides how many run.",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=16,
+        help="Max pages or tracks waiting between stages.",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=POLICIES,
+        default="album",
+        help="Order of track downloads: finish albums first, as found, "
+        "round robin over albums or smallest first.",
+    )
+    parser.add_argument(
+        "--variant",
+        choices=VARIANT_POLICIES,
+        default="first",
+        help="Which of a track's downloads to fetch: the first the site lists "
+        "or the smallest.",
+    )
+    parser.add_argument(
+        "--formats",
+        type=lambda value: value.split(","),
+        help="Comma separated download formats to take, in order of preference. "
+        "Tracks are named by format, and only mp3 tracks are tagged with --tag.",
+    )
+    parser.add_argument(
+        "--bitrate",
+        type=int,
+        help="Prefer the highest bitrate download at or under this many kbit/s.",
+    )
+    parser.add_argument(
+        "--max_track_size",
+        type=float,
+        help="Skip downloads listed as larger than this many MB, unless a track "
+        "has no smaller one.",
     )
     args = parser.parse_args()
 
-    SITE_URL = args.site_url or os.environ.get("SITE_URL")
+    SITE_URLS = [(url, args.a) for url in args.site_url or []]
+    if args.url_file:
+        SITE_URLS += read_url_file(args.url_file)
+    if not SITE_URLS and os.environ.get("SITE_URL"):
+        SITE_URLS = [(os.environ.get("SITE_URL"), args.a)]
     MUSIC_PATH = args.music_path or os.environ.get("MUSIC_PATH")
     COLLECTION_PATH_PATTERN = os.environ.get("COLLECTION_PATH_PATTERN")
-    IS_ALBUM = args.a
-
-    if not SITE_URL:
+    MANIFEST_PATH = args.manifest
+    CATALOG_PATH = args.catalog
+    PLAN_PATH = args.plan
+    EXECUTE_PATH = args.execute
+    SHARD = args.shard
+    STORE = args.store
+    SYMLINK = args.symlink
+    TAG = args.tag
+    WORKER = args.worker
+    WORKER_SOCKET = args.socket
+    RULES_PATH = args.rules
+    CACHE_PATH = args.cache
+    CACHE_TTL = args.cache_ttl
+    CACHE_SIZE = args.cache_size
+    OFFLINE = args.offline
+    PAGE_WORKERS = args.page_workers
+    PARSE_WORKERS = args.parse_workers
+    INLINE_PARSE = args.inline_parse
+    DOWNLOAD_WORKERS = args.download_workers or args.max_concurrency
+    QUEUE_SIZE = args.queue_size
+    SCHEDULE = args.schedule
+    VARIANT = args.variant
+    FORMATS = args.formats
+    BITRATE = args.bitrate
+    MAX_TRACK_SIZE = args.max_track_size
+    CONCURRENCY = args.concurrency
+    MAX_CONCURRENCY = args.max_concurrency
+    RETRIES = args.retries
+    BACKOFF = args.backoff
+    METRICS_PATH = args.metrics
+    METRICS_PORT = args.metrics_port
+
+    if not SITE_URLS and not EXECUTE_PATH and not WORKER:
         raise ValueError(
             "Site URL is required. Have you set the SITE_URL env variable?"
         )
@@ -470,10 +978,14 @@ if __name__ == "__main__":
             "Music path is required. Have you set the MUSIC_PATH env variable?"
         )
 
-    if not COLLECTION_PATH_PATTERN:
+    if not COLLECTION_PATH_PATTERN and not EXECUTE_PATH:
         raise ValueError(
             "Pattern is required. Have you set the COLLECTION_PATH_PATTERN env variable?"
         )
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    log_listener = setup_logging(args.log_level, args.log_file)
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(main())
+    finally:
+        log_listener.stop()
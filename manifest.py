@@ -0,0 +1,97 @@
+"""Persistent manifest of downloaded tracks."""
+import collections
+import sqlite3
+import time
+
+ManifestEntry = collections.namedtuple(
+    "ManifestEntry", ["url", "path", "size", "etag", "last_modified", "sha256"]
+)
+
+
+class Manifest:
+    """Record of each track's source url, validators and final path."""
+
+    def __init__(self, path):
+        """Open or create the manifest database."""
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.add_column("sha256", "TEXT")
+        self.add_column("variant", "TEXT")
+        self.connection.commit()
+
+    def add_column(self, name, column_type):
+        """Add a column to manifests made by older versions."""
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(downloads)")
+        ]
+        if name not in columns:
+            self.connection.execute(
+                f"ALTER TABLE downloads ADD COLUMN {name} {column_type}"
+            )
+
+    def get(self, url):
+        """Return the entry for url or None."""
+        row = self.connection.execute(
+            """
+            SELECT url, path, size, etag, last_modified, sha256
+            FROM downloads WHERE url = ?
+            """,
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        return ManifestEntry(*row)
+
+    def get_all(self):
+        """Return every entry by path."""
+        rows = self.connection.execute(
+            "SELECT url, path, size, etag, last_modified, sha256 FROM downloads"
+        )
+        return {row[1]: ManifestEntry(*row) for row in rows}
+
+    def record(  # pylint: disable=too-many-arguments
+        self, url, path, size, etag, last_modified, sha256=None
+    ):
+        """Insert or replace the entry for url.
+
+        A size of None marks a download that has started but not finished.
+        """
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO downloads
+                (url, path, size, etag, last_modified, sha256, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (url, path, size, etag, last_modified, sha256, time.time()),
+        )
+        self.connection.commit()
+
+    def set_variant(self, url, variant):
+        """Record which of the site's download variants url is."""
+        self.connection.execute(
+            "UPDATE downloads SET variant = ? WHERE url = ?", (variant, url)
+        )
+        self.connection.commit()
+
+    def remove(self, url):
+        """Forget url, so it is downloaded again."""
+        self.connection.execute("DELETE FROM downloads WHERE url = ?", (url,))
+        self.connection.commit()
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
@@ -2,11 +2,36 @@
 """Tools to manage metadata on mp3."""
 import argparse
 import asyncio
+import concurrent.futures
 import os
 import re
 import shutil
 
-from mutagen import File
+from mutagen.id3 import ID3, Frames, ID3NoHeaderError
+
+from catalog import Catalog
+from file_links import LINK_SUFFIX, link_into_place
+from rename_rules import DEFAULT_RULES_PATH, NUMBERED_TAG, RenameRules
+from tag_index import IndexEntry, TagIndex
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # pylint: disable=invalid-name
+
+# ID3v2 frames read for renaming, by metadata key. TYER lets v2.3 dates
+# become TDRC, and TXXX holds the scraper's numbered mark.
+TAG_FRAMES = {
+    "TPE1": "artist",
+    "TALB": "album",
+    "TIT2": "title",
+    "TRCK": "track_no",
+    "TDRC": "track_date",
+}
+KNOWN_FRAMES = {name: Frames[name] for name in list(TAG_FRAMES) + ["TXXX", "TYER"]}
+
+# Linux ioctl to share a file's extents on btrfs, XFS and other CoW filesystems.
+FICLONE = 0x40049409
 
 
 def show_all_keys(audio):
@@ -27,50 +52,91 @@ def get_name_part(filepath):
     return None
 
 
-def parse_mp3_metadata(filepath):
-    """Parse mp3 metadata."""
-    metadata = {}
+def read_tags(filepath):
+    """Read the text of the TAG_FRAMES frames and NUMBERED_TAG from the ID3v2 tag.
+
+    Only the tag at the start of the file is read and only these frames are
+    decoded, unlike mutagen.File(), which also sniffs the format, reads the mpeg
+    stream info and looks for an ID3v1 tag at the end.
+    """
+    try:
+        tags = ID3(filepath, known_frames=KNOWN_FRAMES, load_v1=False)
+    except ID3NoHeaderError:
+        return {}
+
+    values = {name: str(tags[name][0]) for name in TAG_FRAMES if tags.get(name)}
+    if tags.get(NUMBERED_TAG):
+        values[NUMBERED_TAG] = str(tags[NUMBERED_TAG])
+
+    return values
+
+
+def read_all_tags(filepaths, workers=None, processes=False):
+    """Read tags of many files in a thread or process pool.
+
+    Return a dict of tags by filepath.
+    """
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
 
-    audio = File(filepath)
+    with executor:
+        return dict(zip(filepaths, executor.map(read_tags, filepaths, chunksize=64)))
 
-    if audio is not None and audio.tags is not None:
-        if "TPE1" in audio.tags:
-            metadata["artist"] = audio.tags["TPE1"][0]
-        if "TALB" in audio.tags:
-            metadata["album"] = audio.tags["TALB"][0]
-        if "TIT2" in audio.tags:
-            metadata["title"] = audio.tags["TIT2"][0]
-        if "TRCK" in audio.tags:
-            metadata["track_no"] = audio.tags["TRCK"][0]
-        if "TDRC" in audio.tags:
-            metadata["track_date"] = audio.tags["TDRC"][0]
-        # Add more tags as needed
 
-    return metadata
+def get_catalog_tags(entry):
+    """Return the tags read_tags would give the track of a catalog entry."""
+    # The site numbers tracks in tens.
+    tags = {"TALB": entry.album, "TIT2": entry.title, "TRCK": str(entry.track_no * 10)}
+    if entry.tagged:
+        tags[NUMBERED_TAG] = "1"
 
+    return tags
 
-def get_track_padding(filepath):
-    """Get padding size for track."""
-    three_wide = ["Hymns-Music Only", "Hymns-Words and Music", "Childrens Songbook"]
 
-    for pattern in three_wide:
-        if pattern in filepath:
-            return 3
+def get_catalog_files(catalog):
+    """Return the catalog's tracks that are still there, and their tags by path."""
+    known_tags = {
+        filepath: get_catalog_tags(entry)
+        for filepath, entry in catalog.get_all().items()
+        if os.path.isfile(filepath)
+    }
+    return sorted(known_tags), known_tags
 
-    return 2
+
+def search_catalog(catalog, text):
+    """Print the catalog's tracks matching text."""
+    for entry in catalog.search(text):
+        album = f"{entry.collection}/{entry.album}" if entry.collection else entry.album
+        print(f"{entry.path}\t{album}\t{entry.track_no}\t{entry.title}")
+
+
+def parse_mp3_metadata(filepath):
+    """Parse mp3 metadata."""
+    tags = read_tags(filepath)
+    return {key: tags[name] for name, key in TAG_FRAMES.items() if name in tags}
 
 
 def rename_file(filepath, new_filename):
-    """Rename file to new filename."""
+    """Rename file to new filename and return where the file is now."""
     # Generate the new filename based on the metadata
     new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
+    if new_filepath == filepath:
+        return filepath
+
+    # Never overwrite another track that already has the new name.
+    if os.path.exists(new_filepath):
+        print(f"Skip rename of {filepath}, {new_filepath} exists")
+        return filepath
 
     # Rename the file
     print(f"Rename {filepath} to {new_filepath}")
-    # os.rename(filepath, new_filepath)
+    os.rename(filepath, new_filepath)
+    return new_filepath
 
 
-async def copy_file(source, destination):
+def copy_file(source, destination):
     """Copy the file."""
     source_filepath = os.path.abspath(source)
     destination_filepath = os.path.abspath(destination)
@@ -81,10 +147,72 @@ async def copy_file(source, destination):
     shutil.copy2(source_filepath, destination_filepath)
 
 
+def link_file(source, destination):
+    """Hardlink the file, copying it when the link is not possible."""
+    destination_filepath = os.path.abspath(destination)
+
+    os.makedirs(os.path.dirname(destination_filepath), exist_ok=True)
+    if link_into_place(source, destination_filepath, shutil.copy2):
+        print(f"Link {source} to {destination_filepath}")
+    else:
+        print(f"Copy {source} to {destination_filepath}")
+
+
+def clone_file(source_file, destination_file):
+    """Clone a whole file with a FICLONE reflink or copy_file_range."""
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            return
+        except OSError:
+            pass
+
+    remaining = os.fstat(source_file.fileno()).st_size
+    while remaining > 0:
+        copied = os.copy_file_range(
+            source_file.fileno(), destination_file.fileno(), remaining
+        )
+        if copied == 0:
+            break
+        remaining -= copied
+
+
+def reflink_file(source, destination):
+    """Clone the file without copying its data where the filesystem allows.
+
+    Tries a FICLONE reflink, then copy_file_range, which the kernel can
+    serve without reading the data into user space, then a plain copy.
+    """
+    destination_filepath = os.path.abspath(destination)
+    os.makedirs(os.path.dirname(destination_filepath), exist_ok=True)
+
+    try:
+        with open(source, "rb") as source_file, open(
+            destination_filepath, "wb"
+        ) as destination_file:
+            clone_file(source_file, destination_file)
+    except (AttributeError, OSError):
+        # copy_file_range is Linux only and not every filesystem pair allows it.
+        copy_file(source, destination)
+        return
+
+    print(f"Clone {source} to {destination_filepath}")
+    shutil.copystat(source, destination_filepath)
+
+
+ORGANIZERS = {
+    "copy": copy_file,
+    "hardlink": link_file,
+    "reflink": reflink_file,
+}
+
+
 def set_directory(filepath, directory):
     """Rename file to new filename."""
     # Generate the new filename based on the metadata
     path, filename = os.path.split(filepath)
+    # Keep absolute music paths inside directory too.
+    path = os.path.splitdrive(path)[1].lstrip(os.sep)
     new_filepath = os.path.join(directory, path, filename)
 
     # Rename the file
@@ -92,22 +220,6 @@ def set_directory(filepath, directory):
     return new_filepath
 
 
-def needs_new_name(filepath):
-    """Check if file needs new name."""
-    rename_album_paths = [
-        "Childrens Songbook-Music Only",
-        "Children's Songbook-Music Only",
-        "Childrens Songbook-Words and Music",
-        "Hymns-Music Only",
-        "Hymns-Words and Music",
-    ]
-
-    for term in rename_album_paths:
-        if term in filepath:
-            return True
-    return False
-
-
 def parse_filepath(filepath):
     """Parse filepath into parts."""
     filename, _ = os.path.splitext(filepath)
@@ -123,122 +235,169 @@ def parse_filepath(filepath):
     return (album_path, track_name, track_no)
 
 
-def remove_track_no_trailing_zero(filepath):
-    """Remove track number trailing zero."""
-    _, track_name, track_no = parse_filepath(filepath)
-
-    # Remove trailing zero
-    track_no = track_no[:-1]
-    track_no = int(track_no)
-
-    # Update filename with new track
-    padding_len = get_track_padding(filepath)
-    new_filename = f"{track_no:0{padding_len}d} {track_name}.mp3"
-
-    # update filename only
-    new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
-    return new_filepath
-
-
-def use_tag_track_no(filepath):
-    """Use track tag number."""
-    album_path, track_name, track_no = parse_filepath(filepath)
-
-    audio = File(filepath)
-    track_no = audio.tags.get("TRCK", [track_no])[0]
-
-    if "Let the Holy Spirit Guide" in filepath:
-        track_no = "1430"
-
-    if "If You Could Hie to Kolob" in filepath:
-        track_no = "2840"
-
-    if "Words and Music" in album_path:
-        if "I Saw a Mighty Angel Fly" in filepath:
-            track_no = "150"
-
-    if "Music Only" in album_path:
-        if "Prayer of Thanksgiving" in filepath:
-            track_no = "930"
-
-    if "Children's Songbook-Music Only" in album_path:
-        track_no = track_no[:-1]
-        track_no = int(track_no)
-        if "Heritage" in filepath:
-            track_no = track_no + 30
-        if "Nature and Seasons" in filepath:
-            track_no = track_no + 33
-        if "Prelude Music" in filepath:
-            track_no = track_no + 32
-        track_no = f"{track_no:d}0"
-
-    track_no = int(track_no)
-
-    # update file with track no
-    padding_len = get_track_padding(filepath)
-    new_filename = f"{track_no:0{padding_len}d} {track_name}.mp3"
-
-    # update filename only
-    new_filepath = os.path.join(os.path.dirname(filepath), new_filename)
-    return new_filepath
-
+def get_music_files(path):
+    """List the tracks under path."""
+    filepaths = []
+    for root, dirs, files in os.walk(path):
+        # Skip the scraper's track store.
+        dirs[:] = [folder for folder in dirs if not folder.startswith(".")]
+        for file in files:
+            # Skip the scraper's manifest, cache, partial downloads and links.
+            if file.startswith(".") or file.endswith((".part", LINK_SUFFIX)):
+                continue
+
+            filepaths.append(os.path.join(root, file))
+
+    return filepaths
+
+
+def get_track_list(  # pylint: disable=too-many-locals
+    index, rules, filepaths, reindex=False, known_tags=None
+):
+    """Return sorted (filepath, destination, applied) for every track.
+
+    Tags and destinations come from the index unless the file changed since
+    it was indexed, so only new and changed files are read. Destinations
+    are worked out again from the indexed tags when the rules change. Files
+    in known_tags, such as those from the catalog, are never read.
+    """
+    known_tags = known_tags or {}
+    entries = {} if reindex else index.get_all()
+    stats = {filepath: os.stat(filepath) for filepath in filepaths}
+    current = {
+        filepath
+        for filepath in filepaths
+        if index.is_current(entries.get(filepath), stats[filepath])
+    }
+    renamed = {filepath for filepath in filepaths if rules.get_album_rule(filepath)}
+
+    # Tags are only needed for renames, so read just those files, in parallel.
+    needed = [
+        filepath
+        for filepath in renamed
+        if filepath not in current or entries[filepath].tags is None
+    ]
+    all_tags = {
+        filepath: known_tags[filepath] for filepath in needed if filepath in known_tags
+    }
+    all_tags.update(
+        read_all_tags(
+            [filepath for filepath in needed if filepath not in known_tags],
+            TAG_WORKERS,
+            TAG_PROCESSES,
+        )
+    )
+    for filepath in filepaths:
+        entry = entries.get(filepath)
+        if filepath not in all_tags and filepath in current:
+            if entry.rules == rules.digest:
+                continue
+            tags = entry.tags
+        else:
+            tags = all_tags.get(filepath)
+
+        if filepath in renamed:
+            destination = rules.get_new_name(filepath, tags)
+        else:
+            destination = filepath
+
+        if entry and filepath in current and entry.destination == destination:
+            applied = entry.applied
+        else:
+            applied = None
+
+        stat = stats[filepath]
+        index.record(filepath, stat, tags, destination, rules.digest)
+        if applied:
+            index.set_applied(filepath, applied)
+        entries[filepath] = IndexEntry(
+            filepath,
+            stat.st_mtime_ns,
+            stat.st_size,
+            tags,
+            destination,
+            applied,
+            rules.digest,
+        )
 
-def get_new_name(filepath):
-    """Get new name for filepath."""
-    # album_path, track_name, track_no = parse_filepath(filepath)
+    index.prune(set(filepaths))
+    index.commit()
+    return sorted(
+        (filepath, entries[filepath].destination, entries[filepath].applied)
+        for filepath in filepaths
+    )
 
-    if "Hymns-Words and Music" in filepath:
-        new_filepath = use_tag_track_no(filepath)
-        new_filepath = remove_track_no_trailing_zero(new_filepath)
-        return new_filepath
 
-    if "Hymns-Music Only" in filepath:
-        new_filepath = use_tag_track_no(filepath)
-        new_filepath = remove_track_no_trailing_zero(new_filepath)
-        return new_filepath
+async def organize_track(  # pylint: disable=too-many-arguments
+    executor, index, source, destination, applied, catalog=None
+):
+    """Apply the organize step to one track unless the index says it is done."""
+    event_loop = asyncio.get_event_loop()
+    if ORGANIZE == "rename":
+        if destination == source:
+            return
 
-    if "Childrens Songbook-Music Only" in filepath:
-        new_filepath = use_tag_track_no(filepath)
-        new_filepath = remove_track_no_trailing_zero(new_filepath)
-        return new_filepath
+        new_filepath = await event_loop.run_in_executor(
+            executor, rename_file, source, os.path.basename(destination)
+        )
+        if new_filepath != source:
+            index.move(source, new_filepath)
+            if catalog:
+                catalog.move(source, new_filepath)
+        return
+
+    new_filename = set_directory(destination, OUTPUT_PATH)
+    step = f"{ORGANIZE}:{new_filename}"
+    if applied == step:
+        return
+
+    await event_loop.run_in_executor(
+        executor, ORGANIZERS[ORGANIZE], source, new_filename
+    )
+    index.set_applied(source, step)
 
-    if "Children's Songbook-Music Only" in filepath:
-        new_filepath = use_tag_track_no(filepath)
-        new_filepath = remove_track_no_trailing_zero(new_filepath)
-        return new_filepath
 
-    if "Childrens Songbook-Words and Music" in filepath:
-        new_filepath = use_tag_track_no(filepath)
-        new_filepath = remove_track_no_trailing_zero(new_filepath)
-        return new_filepath
+def open_catalog():
+    """Open the scraper's catalog of the music folder."""
+    catalog_path = CATALOG_PATH or os.path.join(MUSIC_PATH, ".catalog.sqlite")
+    if not os.path.exists(catalog_path):
+        raise ValueError(
+            f"No catalog at {catalog_path}. Has main.py downloaded into this folder?"
+        )
 
-    return filepath
+    return Catalog(catalog_path, MUSIC_PATH)
 
 
 async def main():
     """Use metadata to update files."""
-    track_list = []
-    path = MUSIC_PATH
-    path = "music_20230710_2/Children's Songbook-Music Only"
-    for root, _, files in os.walk(path):
-        for file in files:
-
-            filepath = os.path.join(root, file)
-
-            if needs_new_name(filepath):
-                new_filepath = get_new_name(filepath)
-                track_list.append((filepath, new_filepath))
-            else:
-                track_list.append((filepath, filepath))
-
-    sorted_lst = sorted(track_list)
-    tasks = []
-    for item in sorted_lst:
-        source, destination = item
-        new_filename = set_directory(destination, "music_renamed")
-        tasks.append(copy_file(source, new_filename))
-
-    await asyncio.gather(*tasks)
+    catalog = open_catalog() if FROM_CATALOG or SEARCH else None
+    if SEARCH:
+        search_catalog(catalog, SEARCH)
+        catalog.close()
+        return
+
+    if catalog:
+        filepaths, known_tags = get_catalog_files(catalog)
+    else:
+        filepaths, known_tags = get_music_files(MUSIC_PATH), None
+    rules = RenameRules.load(RULES_PATH)
+    index = TagIndex(INDEX_PATH or os.path.join(MUSIC_PATH, ".metadata.sqlite"))
+    try:
+        track_list = get_track_list(index, rules, filepaths, REINDEX, known_tags)
+        with concurrent.futures.ThreadPoolExecutor(ORGANIZE_WORKERS) as executor:
+            await asyncio.gather(
+                *[
+                    organize_track(
+                        executor, index, source, destination, applied, catalog
+                    )
+                    for source, destination, applied in track_list
+                ]
+            )
+    finally:
+        index.commit()
+        index.close()
+        if catalog:
+            catalog.close()
 
 
 if __name__ == "__main__":
@@ -251,9 +410,78 @@ if __name__ == "__main__":
         "-m",
         help="Path to music folder",
     )
+    parser.add_argument(
+        "--organize",
+        choices=["copy", "hardlink", "reflink", "rename"],
+        default="copy",
+        help="Copy, hardlink or reflink tracks into the output path, or rename them in place.",
+    )
+    parser.add_argument(
+        "--output_path",
+        "-o",
+        default="music_renamed",
+        help="Folder to organize tracks into.",
+    )
+    parser.add_argument(
+        "--organize_workers",
+        type=int,
+        default=8,
+        help="Number of threads copying, linking or renaming files.",
+    )
+    parser.add_argument(
+        "--rules",
+        default=DEFAULT_RULES_PATH,
+        help="Rename rules file. Defaults to rename_rules.json.",
+    )
+    parser.add_argument(
+        "--index",
+        help="Path to the tag and rename index. Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--catalog",
+        help="Path to the catalog main.py writes. Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--from_catalog",
+        action="store_true",
+        help="Take tracks and their numbers from the catalog instead of walking "
+        "the music folder and reading tags.",
+    )
+    parser.add_argument(
+        "--search",
+        help="List the catalog's tracks whose title, album or collection has "
+        "these words, and exit.",
+    )
+    parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Read every file again instead of trusting the index.",
+    )
+    parser.add_argument(
+        "--tag_workers",
+        type=int,
+        default=min(32, (os.cpu_count() or 1) * 4),
+        help="Number of threads, or processes, reading tags.",
+    )
+    parser.add_argument(
+        "--tag_processes",
+        action="store_true",
+        help="Read tags in a process pool instead of threads.",
+    )
     args = parser.parse_args()
 
     MUSIC_PATH = args.music_path or os.environ.get("MUSIC_PATH")
+    TAG_WORKERS = args.tag_workers
+    ORGANIZE = args.organize
+    OUTPUT_PATH = args.output_path
+    ORGANIZE_WORKERS = args.organize_workers
+    TAG_PROCESSES = args.tag_processes
+    INDEX_PATH = args.index
+    RULES_PATH = args.rules
+    REINDEX = args.reindex
+    CATALOG_PATH = args.catalog
+    FROM_CATALOG = args.from_catalog
+    SEARCH = args.search
 
     if not MUSIC_PATH:
         raise ValueError(
@@ -0,0 +1,186 @@
+"""Run metrics with a json summary and a Prometheus text endpoint."""
+import collections
+import math
+import time
+
+from aiohttp import web
+
+# Upper bounds in seconds, shared by every stage so histograms line up.
+BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    math.inf,
+)
+
+
+class Histogram:
+    """Fixed bucket latency histogram."""
+
+    def __init__(self):
+        """Start with empty buckets."""
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Add a duration."""
+        for idx, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[idx] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def get_percentile(self, percentile):
+        """Estimate percentile by interpolating within its bucket."""
+        if not self.count:
+            return None
+
+        rank = percentile / 100 * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(BUCKETS, self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if bound == math.inf:
+                    return round(self.max, 6)
+                estimate = lower + (bound - lower) * (rank - seen) / bucket_count
+                return round(min(estimate, self.max), 6)
+            seen += bucket_count
+            lower = bound
+
+        return round(self.max, 6)
+
+    def summary(self):
+        """Return json friendly totals and percentiles."""
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "p50": self.get_percentile(50),
+            "p99": self.get_percentile(99),
+            "max": round(self.max, 6),
+        }
+
+
+class Metrics:
+    """Counters, gauges, stage latencies and album completion times for a run.
+
+    Updates are plain attribute and dict writes on the event loop, so they
+    cost little next to the work they measure.
+    """
+
+    def __init__(self):
+        """Start the run clock."""
+        self.started = time.monotonic()
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.gauge_max = {}
+        self.stages = collections.defaultdict(Histogram)
+        # [first track queued, last track finished, tracks] per album.
+        self.albums = {}
+
+    def count(self, name, value=1):
+        """Add value to a counter."""
+        self.counters[name] += value
+
+    def gauge(self, name, value):
+        """Set a gauge, keeping its highest value."""
+        self.gauges[name] = value
+        self.gauge_max[name] = max(value, self.gauge_max.get(name, value))
+
+    def observe(self, stage, seconds):
+        """Add a stage duration."""
+        self.stages[stage].observe(seconds)
+
+    def album_queued(self, album):
+        """Note a track queued for album."""
+        if album not in self.albums:
+            self.albums[album] = [time.monotonic(), None, 0]
+
+    def album_track_done(self, album):
+        """Note a track of album finished."""
+        times = self.albums.get(album)
+        if times is not None:
+            times[1] = time.monotonic()
+            times[2] += 1
+
+    def summary(self):
+        """Return the run metrics as json friendly data."""
+        return {
+            "seconds": round(time.monotonic() - self.started, 3),
+            "counters": dict(self.counters),
+            "gauges": {
+                name: {"last": value, "max": self.gauge_max[name]}
+                for name, value in self.gauges.items()
+            },
+            "stages": {
+                stage: histogram.summary() for stage, histogram in self.stages.items()
+            },
+            "albums": [
+                {
+                    "album": "/".join(part for part in album if part),
+                    "tracks": tracks,
+                    "seconds": round(finished - queued, 3) if finished else None,
+                }
+                for album, (queued, finished, tracks) in self.albums.items()
+            ],
+        }
+
+    def render(self):
+        """Return the metrics in the Prometheus text format."""
+        lines = ["# TYPE scraper_stage_seconds histogram"]
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, histogram.counts):
+                cumulative += bucket_count
+                bound_label = "+Inf" if bound == math.inf else bound
+                lines.append(
+                    f'scraper_stage_seconds_bucket{{stage="{stage}",le="{bound_label}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(
+                f'scraper_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}'
+            )
+            lines.append(
+                f'scraper_stage_seconds_count{{stage="{stage}"}} {histogram.count}'
+            )
+
+        for name, value in self.counters.items():
+            lines += [
+                f"# TYPE scraper_{name}_total counter",
+                f"scraper_{name}_total {value}",
+            ]
+
+        for name, value in self.gauges.items():
+            lines += [f"# TYPE scraper_{name} gauge", f"scraper_{name} {value}"]
+
+        lines += ["# TYPE scraper_albums gauge", f"scraper_albums {len(self.albums)}"]
+        return "\n".join(lines) + "\n"
+
+    async def handle_metrics(self, request):  # pylint: disable=unused-argument
+        """Serve the Prometheus text."""
+        return web.Response(text=self.render(), content_type="text/plain")
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics on port and return the runner to clean up."""
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
@@ -0,0 +1,335 @@
+"""Parse collection, album and track pages into plain data."""
+import collections
+import html
+import json
+import re
+import urllib.parse
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+PageScan = collections.namedtuple(
+    "PageScan", ["h1_title", "header_title", "json_text", "has_json", "collection_id"]
+)
+
+CollectionPage = collections.namedtuple(
+    "CollectionPage", ["title", "has_json", "json_data", "album_links"]
+)
+AlbumPage = collections.namedtuple(
+    "AlbumPage", ["title", "collection_id", "has_json", "json_data", "track_links"]
+)
+TrackPage = collections.namedtuple("TrackPage", ["title", "audio_src"])
+
+GRID_VIEW = SoupStrainer("div", attrs={"data-testid": "CollectionGridView"})
+LIST_VIEW = SoupStrainer("div", attrs={"data-testid": "CollectionListView"})
+
+# Script and comment bodies are consumed whole so tags inside them are skipped.
+TOKEN_PATTERN = re.compile(
+    r"<!--.*?-->"
+    r"|<script\b(?P<script_attrs>[^>]*)>(?P<script>.*?)</script\s*>"
+    r"|<a\b(?P<a_attrs>[^>]*)>"
+    r"|(?P<header><header\b[^>]*>)"
+    r"|(?P<h1><h1\b[^>]*>)",
+    re.DOTALL | re.IGNORECASE,
+)
+# Tags inside the header, with comment and script bodies consumed whole too.
+HEADER_TOKEN_PATTERN = re.compile(
+    r"<!--.*?-->"
+    r"|<script\b[^>]*>.*?</script\s*>"
+    r"|<(/?)([a-zA-Z][^\s/>]*)[^>]*?(/?)>",
+    re.DOTALL | re.IGNORECASE,
+)
+H1_END_PATTERN = re.compile(r"</h1\s*>", re.IGNORECASE)
+HREF_PATTERN = re.compile(
+    r"""(?:^|\s)href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE
+)
+JSON_TYPE_PATTERN = re.compile(
+    r"""(?:^|\s)type\s*=\s*["']?application/json\b""", re.IGNORECASE
+)
+MARKUP_PATTERN = re.compile(r"<!--.*?-->|<[^>]*>", re.DOTALL)
+
+# Tags a track detail div holds, as bits so subtrees can be merged cheaply.
+TRACK_DETAIL_TAGS = {"button": 1, "h1": 2, "section": 4}
+TRACK_DETAIL_TAGS_FOUND = 7
+
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+def clean_name(name):
+    """Ensure title is a valid name."""
+    name = name.replace("<em>", "")
+    name = name.replace("—", "-")
+    name = name.replace("–", "-")
+    name = name.replace("‘", "'")
+    name = name.replace("’", "'")
+    # track_title = track_title.replace("?","")
+    # track_title = track_title.replace("!","")
+    name = re.sub(r"[^a-zA-Z0-9\s\.\-\']", "", name)
+    name = name.replace("  ", " ")
+    name = name.replace("  ", " ")
+    return name
+
+
+def join_url(base_url, link):
+    """Join base url with relative link."""
+    parsed_original = urllib.parse.urlparse(base_url)
+    joined_link = urllib.parse.urljoin(
+        parsed_original.scheme + "://" + parsed_original.netloc, link
+    )
+    return joined_link
+
+
+def get_text(fragment):
+    """Return the text of an html fragment."""
+    return html.unescape(MARKUP_PATTERN.sub("", fragment))
+
+
+def get_h1_text(text, start):
+    """Return the text of the h1 whose start tag ends at start."""
+    match = H1_END_PATTERN.search(text, start)
+    end = match.start() if match else len(text)
+    return get_text(text[start:end])
+
+
+def get_child_h1_text(text, start):
+    """Return the text of the first h1 directly inside the header starting at start."""
+    depth = 0
+    for match in HEADER_TOKEN_PATTERN.finditer(text, start):
+        closing, name, self_closing = match.groups()
+        if name is None:
+            # A comment, or a script that holds no h1.
+            continue
+
+        name = name.lower()
+        if closing and name == "header":
+            return None
+        if closing:
+            depth = max(depth - 1, 0)
+        elif name == "h1" and depth == 0:
+            return get_h1_text(text, match.end())
+        elif not self_closing and name not in VOID_ELEMENTS:
+            depth += 1
+
+    return None
+
+
+def get_href_collection_id(attrs):
+    """Return the collectionId query parameter of an anchor's href."""
+    if "collectionId" not in attrs:
+        return None
+
+    match = HREF_PATTERN.search(attrs)
+    if not match:
+        return None
+
+    href = html.unescape(next(group for group in match.groups() if group is not None))
+    query_params = urllib.parse.parse_qs(urllib.parse.urlparse(href).query)
+    if "collectionId" in query_params:
+        return query_params["collectionId"][0]
+
+    return None
+
+
+def has_album_detail(div_element):
+    """Check if element has album info."""
+    if len(div_element.contents) != 2:
+        return False
+
+    child1 = div_element.contents[0]
+    child2 = div_element.contents[1]
+
+    # Check if both children are divs
+    if child1.name != "div" or child2.name != "div":
+        return False
+
+    # Check if second is only text in div
+    if child2.contents and not isinstance(child2.contents[0], str):
+        return False
+
+    return True
+
+
+def get_collection_id(soup):
+    """Return the collection id for the page."""
+    anchor_tags = soup.find_all("a")
+    for anchor_tag in anchor_tags:
+        href = anchor_tag.get("href")
+        if href:
+            parsed_url = urllib.parse.urlparse(href)
+            query_params = urllib.parse.parse_qs(parsed_url.query)
+            if "collectionId" in query_params:
+                collection_id = query_params["collectionId"][0]
+                return collection_id
+
+    return None
+
+
+def get_album_links(soup):
+    """Get album links from site."""
+    album_links = []
+
+    div_album_collection = soup.find("div", attrs={"data-testid": "CollectionGridView"})
+    for a_tag in div_album_collection.find_all("a"):
+        for a_div in a_tag.find_all("div"):
+            if has_album_detail(a_div):
+                # Get the first two child divs
+                child_divs = a_div.find_all("div", recursive=False)
+                album_track_count = child_divs[0].text.strip()
+                album_title = child_divs[1].text.strip()
+
+                album_links.append((album_title, album_track_count, a_tag["href"]))
+
+    return album_links
+
+
+def get_track_links(soup):
+    """Get track links from an album list view."""
+    div_track_collection = soup.find("div", attrs={"data-testid": "CollectionListView"})
+    return [
+        a_tag["href"] for a_tag in div_track_collection.find_all("a", recursive=False)
+    ]
+
+
+def find_track_details(soup):
+    """Get the track title and audio link from a track page.
+
+    The title is the first h1 in the last div, in document order, that holds
+    an h1, a button and a section. Walking tags in reverse document order
+    visits every descendant of a div before the div, so one pass can carry
+    what each subtree holds up to its parent.
+    """
+    track_title = None
+    contains = {}
+    first_h1 = {}
+    for tag in reversed(soup.find_all(True)):
+        tag_contains = contains.pop(id(tag), 0)
+        tag_first_h1 = first_h1.pop(id(tag), None)
+        if tag.name == "div" and tag_contains == TRACK_DETAIL_TAGS_FOUND:
+            track_title = tag_first_h1.text
+            break
+
+        parent_id = id(tag.parent)
+        contains[parent_id] = (
+            contains.get(parent_id, 0)
+            | tag_contains
+            | TRACK_DETAIL_TAGS.get(tag.name, 0)
+        )
+        # Earlier siblings come later in the walk, so the last write wins.
+        if tag.name == "h1":
+            first_h1[parent_id] = tag
+        elif tag_first_h1 is not None:
+            first_h1[parent_id] = tag_first_h1
+
+    # get audio link
+    audio_src = None
+    audio_tag = soup.find("audio")
+    if audio_tag and audio_tag.has_attr("src"):
+        audio_src = audio_tag["src"]
+
+    return TrackPage(track_title, audio_src)
+
+
+def has_json_data(soup):
+    """Check if page has json data."""
+    # Search for the text 'mp3' or 'pageProps' in script tags
+    script_tags = soup.find_all("script")
+    for script_tag in script_tags:
+        script_text = script_tag.get_text()
+        if "mp3" in script_text or "pageProps" in script_text:
+            return True
+
+    return False
+
+
+def scan_page(text):
+    """Pull titles, page json and the collection id out of raw html in one pass.
+
+    Matches what the BeautifulSoup lookups return for the first h1, the h1
+    directly inside the first header, the first application/json script,
+    has_json_data and get_collection_id, without building a tree.
+    """
+    h1_title = None
+    header_title = None
+    json_text = None
+    has_json = False
+    collection_id = None
+    seen_header = False
+
+    for match in TOKEN_PATTERN.finditer(text):
+        script = match.group("script")
+        if script is not None:
+            if json_text is None and JSON_TYPE_PATTERN.search(
+                match.group("script_attrs")
+            ):
+                json_text = script
+            if "mp3" in script or "pageProps" in script:
+                has_json = True
+
+        elif match.group("a_attrs") is not None:
+            if collection_id is None:
+                collection_id = get_href_collection_id(match.group("a_attrs"))
+
+        elif match.group("header") is not None:
+            if not seen_header:
+                seen_header = True
+                header_title = get_child_h1_text(text, match.end())
+
+        elif match.group("h1") is not None:
+            if h1_title is None:
+                h1_title = get_h1_text(text, match.end())
+
+    return PageScan(h1_title, header_title, json_text, has_json, collection_id)
+
+
+def parse_collection_page(text):
+    """Parse a collection page."""
+    scan = scan_page(text)
+    json_data = None
+    album_links = []
+    if scan.has_json:
+        if scan.json_text is not None:
+            json_data = json.loads(scan.json_text)
+    else:
+        album_links = get_album_links(
+            BeautifulSoup(text, "html.parser", parse_only=GRID_VIEW)
+        )
+
+    return CollectionPage(scan.h1_title, scan.has_json, json_data, album_links)
+
+
+def parse_album_page(text):
+    """Parse an album page."""
+    scan = scan_page(text)
+    json_data = None
+    track_links = []
+    if scan.collection_id:
+        pass
+    elif scan.has_json:
+        if scan.json_text is not None:
+            json_data = json.loads(scan.json_text)
+    else:
+        track_links = get_track_links(
+            BeautifulSoup(text, "html.parser", parse_only=LIST_VIEW)
+        )
+
+    return AlbumPage(
+        scan.header_title, scan.collection_id, scan.has_json, json_data, track_links
+    )
+
+
+def parse_track_page(text):
+    """Parse a track page."""
+    return find_track_details(BeautifulSoup(text, "html.parser"))
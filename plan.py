@@ -0,0 +1,82 @@
+"""Plan files of tracks to download and url files of pages to crawl."""
+import argparse
+import collections
+import json
+import re
+import zlib
+
+Track = collections.namedtuple(
+    "Track",
+    [
+        "collection_title",
+        "album_title",
+        "track_no",
+        "track_title",
+        "audio_src",
+        "size",
+        "variant",
+        "item_id",
+        "extension",
+    ],
+    # Plans written before variants, item ids and extensions were recorded have
+    # none. Tracks with no extension are mp3 files.
+    defaults=[None, None, None],
+)
+
+
+def write_plan_track(file, track):
+    """Write a track to a plan file."""
+    file.write(json.dumps(track._asdict()) + "\n")
+
+
+def in_shard(track, shard):
+    """Check if a track belongs to shard (index, count).
+
+    Tracks are split by album so each album downloads on one worker.
+    """
+    if shard is None:
+        return True
+
+    index, count = shard
+    album_key = f"{track.collection_title}/{track.album_title}".encode("utf-8")
+    return zlib.crc32(album_key) % count == index
+
+
+def read_plan(path, shard=None):
+    """Read the tracks of a plan file that belong to shard."""
+    tracks = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                track = Track(**json.loads(line))
+                if in_shard(track, shard):
+                    tracks.append(track)
+
+    return tracks
+
+
+def parse_shard(value):
+    """Parse an i/N shard argument."""
+    match = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not match or int(match.group(1)) >= int(match.group(2)):
+        raise argparse.ArgumentTypeError("Shard must be i/N with 0 <= i < N.")
+
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_url_line(line):
+    """Parse a `[-a] url` line into (url, is_album), or None if it has no url."""
+    parts = line.split()
+    if not parts or parts[0].startswith("#"):
+        return None
+
+    if parts[0] == "-a":
+        return (parts[1], True) if len(parts) > 1 else None
+
+    return parts[0], False
+
+
+def read_url_file(path):
+    """Read (url, is_album) entries from a file of `[-a] url` lines."""
+    with open(path, encoding="utf-8") as file:
+        return [entry for entry in map(parse_url_line, file) if entry]
@@ -0,0 +1,192 @@
+"""Track rename rules loaded from a rules file and compiled once."""
+import collections
+import hashlib
+import json
+import os
+import re
+
+AlbumRule = collections.namedtuple(
+    "AlbumRule",
+    [
+        "folder",
+        "padding",
+        "titles",
+        "offsets",
+        "offset_pattern",
+        "tracks",
+        "track_pattern",
+    ],
+)
+
+INDEX_LINE_PATTERN = re.compile(r"(\d+)\s+(.+?)(?:\.mp3)?\s*$")
+DEFAULT_RULES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "rename_rules.json"
+)
+
+# TXXX frame the scraper writes in tracks it numbered as it downloaded them.
+NUMBERED_DESC = "church_music_scraper"
+NUMBERED_TAG = f"TXXX:{NUMBERED_DESC}"
+
+
+def compile_terms(terms):
+    """Compile terms into one pattern matching any of them, longest first."""
+    if not terms:
+        return None
+
+    return re.compile(
+        "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+    )
+
+
+def read_name_index(path):
+    """Read a canonical `NNN Title.mp3` per line index as {title: number}."""
+    titles = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            match = INDEX_LINE_PATTERN.match(line.strip())
+            if match:
+                titles.setdefault(match.group(2), int(match.group(1)))
+
+    return titles
+
+
+def get_file_track_no(filepath):
+    """Return the track title and number at the start of a track's filename."""
+    name, _ = os.path.splitext(os.path.basename(filepath))
+    track_no, _, track_name = name.partition(" ")
+    return track_name.strip(), track_no
+
+
+class RenameRules:
+    """Album folders to renumber, with their padding, indexes and overrides.
+
+    The rules file maps album folder names to rules. A track in an album is
+    numbered from the first of: a title override from the album's or the
+    global "tracks", its title's number in the album's canonical name index,
+    or its position in the album. The first matching path offset is then
+    added to an override or a position, but not to an index number. All
+    album folders are matched with one pattern, and the global overrides and
+    each album's overrides and offsets with one pattern each, so the cost per
+    file does not grow with the number of rules.
+
+    As in the metadata.py cascade the rules replaced, an album's own
+    overrides and offsets only apply to the albums inside its folder, such as
+    the sections of a collection, and not to tracks right in the folder.
+    Renumbered libraries so keep their names.
+    """
+
+    def __init__(self, rules, base_path=".", digest=None):
+        """Compile rules, reading name indexes relative to base_path."""
+        self.digest = digest
+        self.tracks = rules.get("tracks", {})
+        self.track_pattern = compile_terms(self.tracks)
+        self.albums = {}
+        indexes = {}
+        for folder, album in rules.get("albums", {}).items():
+            index_path = album.get("index")
+            if index_path and index_path not in indexes:
+                indexes[index_path] = read_name_index(
+                    os.path.join(base_path, index_path)
+                )
+
+            tracks = album.get("tracks", {})
+            offsets = album.get("offsets", {})
+            self.albums[folder] = AlbumRule(
+                folder,
+                album.get("padding", 2),
+                indexes.get(index_path, {}),
+                offsets,
+                compile_terms(offsets),
+                tracks,
+                compile_terms(tracks),
+            )
+
+        self.album_pattern = compile_terms(self.albums)
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        """Load a json rules file."""
+        with open(path, encoding="utf-8") as file:
+            rules = json.load(file)
+
+        return cls(rules, os.path.dirname(os.path.abspath(path)), cls.get_digest(path))
+
+    @staticmethod
+    def get_digest(path=DEFAULT_RULES_PATH):
+        """Return a digest of the rules file and the indexes it names."""
+        hasher = hashlib.sha256()
+        with open(path, "rb") as file:
+            data = file.read()
+        hasher.update(data)
+
+        base_path = os.path.dirname(os.path.abspath(path))
+        for album in json.loads(data).get("albums", {}).values():
+            if album.get("index"):
+                with open(os.path.join(base_path, album["index"]), "rb") as file:
+                    hasher.update(file.read())
+
+        return hasher.hexdigest()
+
+    def get_album_rule(self, filepath):
+        """Return the rule of the album folder in filepath, or None."""
+        if self.album_pattern is None:
+            return None
+
+        match = self.album_pattern.search(filepath)
+        return self.albums[match.group(0)] if match else None
+
+    @staticmethod
+    def find(pattern, terms, text):
+        """Return the value of the first of terms in text, or None."""
+        match = pattern.search(text) if pattern else None
+        return terms[match.group(0)] if match else None
+
+    def get_track_no(self, rule, filepath, track_name, position):
+        """Return the new track number of a track at position in rule's album."""
+        # The folders above the track's album.
+        parent = os.path.dirname(os.path.dirname(filepath))
+        in_rule_folder = rule.folder in parent
+
+        track_no = None
+        if in_rule_folder:
+            track_no = self.find(rule.track_pattern, rule.tracks, filepath)
+        if track_no is None:
+            track_no = self.find(self.track_pattern, self.tracks, filepath)
+        if track_no is None:
+            if track_name in rule.titles:
+                return rule.titles[track_name]
+            track_no = position
+
+        if in_rule_folder:
+            track_no += self.find(rule.offset_pattern, rule.offsets, filepath) or 0
+
+        return track_no
+
+    def get_new_name(self, filepath, tags):
+        """Return filepath with the track number the rules give it."""
+        rule = self.get_album_rule(filepath)
+        if rule is None or NUMBERED_TAG in tags:
+            return filepath
+
+        track_name, file_track_no = get_file_track_no(filepath)
+        extension = os.path.splitext(filepath)[1]
+        # The site numbers tracks in tens.
+        position = int(tags.get("TRCK", file_track_no).split("/")[0]) // 10
+        track_no = self.get_track_no(rule, filepath, track_name, position)
+        new_filename = f"{track_no:0{rule.padding}d} {track_name}{extension}"
+        return os.path.join(os.path.dirname(filepath), new_filename)
+
+    def get_download_name(self, filepath, position):
+        """Return the path and track number for a track about to download.
+
+        filepath is numbered by position in the album.
+        """
+        rule = self.get_album_rule(filepath)
+        if rule is None:
+            return filepath, position
+
+        track_name, _ = get_file_track_no(filepath)
+        extension = os.path.splitext(filepath)[1]
+        track_no = self.get_track_no(rule, filepath, track_name, position)
+        new_filename = f"{track_no:0{rule.padding}d} {track_name}{extension}"
+        return os.path.join(os.path.dirname(filepath), new_filename), track_no
@@ -0,0 +1,86 @@
+"""Hand out queued track downloads in the order a policy picks."""
+import asyncio
+import collections
+import heapq
+import itertools
+
+POLICIES = ["album", "fifo", "round_robin", "smallest"]
+
+
+class DownloadScheduler:  # pylint: disable=too-many-instance-attributes
+    """Bounded priority queue of tracks to download.
+
+    Policies:
+
+    - album: finish albums in the order they were found, so a stopped run
+      leaves a few complete albums instead of many partial ones.
+    - fifo: download tracks in the order they were found.
+    - round_robin: take each album's n-th track before any album's n+1-th,
+      and the collection with fewer tracks taken first between albums.
+    - smallest: download the tracks the site lists as smallest first, and
+      tracks with no listed size last.
+
+    put() adds a track at once and then waits while the queue holds more
+    than maxsize tracks. Waiting producers push back as with asyncio.Queue,
+    but their tracks already compete for the next free download worker.
+    """
+
+    def __init__(self, policy="album", maxsize=0):
+        """Order tracks by policy."""
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown download policy {policy}")
+
+        self.policy = policy
+        self.maxsize = maxsize
+        self._heap = []
+        self._counter = itertools.count()
+        self._albums = {}
+        self._album_turns = collections.Counter()
+        self._collection_turns = collections.Counter()
+        self._changed = asyncio.Condition()
+
+    def get_priority(self, track):
+        """Return the sort key of a track being queued."""
+        album = (track.collection_title, track.album_title)
+        if self.policy == "album":
+            self._albums.setdefault(album, len(self._albums))
+            return (self._albums[album], track.track_no)
+
+        if self.policy == "round_robin":
+            priority = (
+                self._album_turns[album],
+                self._collection_turns[track.collection_title],
+            )
+            self._album_turns[album] += 1
+            self._collection_turns[track.collection_title] += 1
+            return priority
+
+        if self.policy == "smallest":
+            return (track.size if track.size is not None else float("inf"),)
+
+        return ()
+
+    def qsize(self):
+        """Return the number of queued tracks."""
+        return len(self._heap)
+
+    def is_full(self):
+        """Check if the queue holds more than maxsize tracks."""
+        return 0 < self.maxsize < len(self._heap)
+
+    async def put(self, track):
+        """Queue a track, waiting while the queue is over its size."""
+        entry = (self.get_priority(track), next(self._counter), track)
+        heapq.heappush(self._heap, entry)
+        async with self._changed:
+            self._changed.notify_all()
+            await self._changed.wait_for(lambda: not self.is_full())
+
+    async def get(self):
+        """Take the first track in policy order, waiting for one if empty."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._heap)
+            _, _, track = heapq.heappop(self._heap)
+            self._changed.notify_all()
+
+        return track
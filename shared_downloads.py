@@ -0,0 +1,49 @@
+"""Share track downloads of the same audio between albums."""
+from single_flight import SingleFlight
+
+
+class SharedDownloads:  # pylint: disable=too-few-public-methods
+    """Track downloads in flight, by audio url and by file.
+
+    Untagged tracks of the same audio share one download, and the other
+    albums then link the finished file. Tagged tracks differ by album, so
+    only tracks saved to the same file share a call.
+    """
+
+    def __init__(self, save_track, metrics):
+        """Save tracks with the async save_track(track, filename, frames).
+
+        save_track returns the filename and the bytes downloaded, or None for
+        the bytes when the download failed.
+        """
+        self.save_track = save_track
+        self.metrics = metrics
+        self.flights = SingleFlight()
+
+    async def download(self, track, filename, frames=None):
+        """Download a track, or link the download of the same audio in flight.
+
+        Return the number of bytes downloaded, or None when the download failed.
+        """
+        file_key = (track.audio_src, filename)
+        shared = False
+        while True:
+            # Once a shared download is done each album links its own file.
+            if frames or shared or self.flights.is_running(file_key):
+                key = file_key
+            else:
+                key = track.audio_src
+            if not self.flights.is_running(key):
+                break
+
+            self.metrics.count("downloads_coalesced")
+            shared_filename, downloaded = await self.flights.run(key, None)
+            if shared_filename == filename:
+                return None if downloaded is None else 0
+            shared = True
+
+        # After a shared download the manifest points at its file to link.
+        _, downloaded = await self.flights.run(
+            key, self.save_track, track, filename, frames
+        )
+        return downloaded
@@ -0,0 +1,35 @@
+"""Share one run of a call among concurrent callers with the same key."""
+import asyncio
+import functools
+
+
+class SingleFlight:
+    """Calls in flight by key.
+
+    A call is shielded, so it finishes for the callers still waiting on it
+    when the one that started it is cancelled.
+    """
+
+    def __init__(self):
+        """Start with no calls in flight."""
+        self._calls = {}
+
+    def is_running(self, key):
+        """Check if a call for key is in flight."""
+        call = self._calls.get(key)
+        return call is not None and not call.done()
+
+    def _forget(self, key, call):
+        """Drop a finished call unless a newer call for key replaced it."""
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def run(self, key, func, *args):
+        """Return await func(*args), or the result of the call in flight for key."""
+        call = self._calls.get(key)
+        if not self.is_running(key):
+            call = asyncio.ensure_future(func(*args))
+            self._calls[key] = call
+            call.add_done_callback(functools.partial(self._forget, key))
+
+        return await asyncio.shield(call)
@@ -0,0 +1,132 @@
+"""Persistent index of track tags and rename destinations."""
+import collections
+import json
+import sqlite3
+import time
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry",
+    ["path", "mtime_ns", "size", "tags", "destination", "applied", "rules"],
+)
+
+
+class TagIndex:
+    """Tags, destination and last applied organize step for each track.
+
+    An entry is only trusted while the file's mtime and size match, so runs
+    over an unchanged library need one stat per file and no reads.
+    """
+
+    def __init__(self, path):
+        """Open or create the index database."""
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tracks (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                tags TEXT,
+                destination TEXT NOT NULL,
+                applied TEXT,
+                updated REAL NOT NULL
+            )
+            """
+        )
+        self.add_column("rules", "TEXT")
+        self.connection.commit()
+
+    def add_column(self, name, column_type):
+        """Add a column to indexes made by older versions."""
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(tracks)")
+        ]
+        if name not in columns:
+            self.connection.execute(
+                f"ALTER TABLE tracks ADD COLUMN {name} {column_type}"
+            )
+
+    def get_all(self):
+        """Return every entry by path."""
+        rows = self.connection.execute(
+            """
+            SELECT path, mtime_ns, size, tags, destination, applied, rules
+            FROM tracks
+            """
+        )
+        return {
+            row[0]: IndexEntry(
+                row[0], row[1], row[2], json.loads(row[3]) if row[3] else None, *row[4:]
+            )
+            for row in rows
+        }
+
+    @staticmethod
+    def is_current(entry, stat):
+        """Check if entry was made from the file stat describes."""
+        return (
+            entry is not None
+            and entry.mtime_ns == stat.st_mtime_ns
+            and entry.size == stat.st_size
+        )
+
+    def record(  # pylint: disable=too-many-arguments
+        self, path, stat, tags, destination, rules=None
+    ):
+        """Insert or replace the entry for path, clearing what was applied.
+
+        rules is a digest of the rename rules destination was made with.
+        """
+        self.connection.execute(
+            """
+            INSERT OR REPLACE INTO tracks
+                (path, mtime_ns, size, tags, destination, applied, rules, updated)
+            VALUES (?, ?, ?, ?, ?, NULL, ?, ?)
+            """,
+            (
+                path,
+                stat.st_mtime_ns,
+                stat.st_size,
+                None if tags is None else json.dumps(tags),
+                destination,
+                rules,
+                time.time(),
+            ),
+        )
+
+    def set_applied(self, path, applied):
+        """Note the organize step last applied to path."""
+        self.connection.execute(
+            "UPDATE tracks SET applied = ?, updated = ? WHERE path = ?",
+            (applied, time.time(), path),
+        )
+
+    def move(self, path, new_path):
+        """Move the entry for a renamed file, which is now at its destination."""
+        self.connection.execute("DELETE FROM tracks WHERE path = ?", (new_path,))
+        self.connection.execute(
+            """
+            UPDATE tracks SET path = ?, destination = ?, applied = ?, updated = ?
+            WHERE path = ?
+            """,
+            (new_path, new_path, f"rename:{new_path}", time.time(), path),
+        )
+
+    def prune(self, paths):
+        """Drop entries of files that are gone."""
+        gone = [
+            (path,)
+            for (path,) in self.connection.execute("SELECT path FROM tracks")
+            if path not in paths
+        ]
+        self.connection.executemany("DELETE FROM tracks WHERE path = ?", gone)
+
+    def commit(self):
+        """Save changes."""
+        self.connection.commit()
+
+    def close(self):
+        """Close the database."""
+        self.connection.close()
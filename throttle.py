@@ -0,0 +1,192 @@
+"""Retries, backoff and an adaptive concurrency limit for site requests."""
+import asyncio
+import email.utils
+import random
+import time
+
+import aiohttp
+
+MAX_BACKOFF = 30
+MAX_RETRY_AFTER = 300
+OVERLOAD_STATUSES = {429, 503}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def get_backoff(attempt, backoff):
+    """Return a jittered exponential delay for a retry attempt."""
+    return random.uniform(0, min(MAX_BACKOFF, backoff * 2**attempt))
+
+
+def get_retry_after(headers):
+    """Return the Retry-After delay in seconds or None."""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        delay = int(value)
+    else:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        delay = retry_at.timestamp() - time.time()
+
+    return min(max(delay, 0), MAX_RETRY_AFTER)
+
+
+class AdaptiveLimiter:  # pylint: disable=too-many-instance-attributes
+    """Additive increase, multiplicative decrease limit on requests in flight.
+
+    The limit grows by about one per round of requests while the time to
+    response headers stays within latency_factor of the fastest recent
+    response, and halves when the site pushes back. Only requests started
+    after the last decrease can halve it again, so one burst of errors counts
+    once.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=64, latency_factor=3.0):
+        """Initialize the limiter."""
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.min_latency = None
+        self._last_decrease = 0.0
+        self._resume_at = 0.0
+        self._released = asyncio.Event()
+
+    async def acquire(self):
+        """Wait for a free slot and return the request start time."""
+        while self.in_flight >= int(self.limit):
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        return time.monotonic()
+
+    def release(self):
+        """Give back a slot."""
+        self.in_flight -= 1
+        self._released.set()
+
+    def record(self, started, overloaded):
+        """Adjust the limit from a request's outcome."""
+        if overloaded:
+            if started >= self._last_decrease:
+                self.limit = max(self.minimum, self.limit / 2)
+                self._last_decrease = time.monotonic()
+            return
+
+        latency = time.monotonic() - started
+        # Let the baseline drift up so one lucky response does not pin it.
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        else:
+            self.min_latency *= 1.01
+
+        if latency <= self.min_latency * self.latency_factor:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def defer(self, delay):
+        """Hold new requests for delay seconds."""
+        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+
+
+class LimitedResponse:
+    """Response that gives its limiter slot back once released."""
+
+    def __init__(self, response, limiter):
+        """Wrap response."""
+        self._response = response
+        self._limiter = limiter
+        self._released = False
+
+    def __getattr__(self, name):
+        """Forward everything else to the response."""
+        return getattr(self._response, name)
+
+    def release(self):
+        """Release the connection and the limiter slot."""
+        self._response.release()
+        if not self._released:
+            self._released = True
+            self._limiter.release()
+
+    async def __aenter__(self):
+        """Use the response in an async with block."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        """Release the response."""
+        self.release()
+
+
+class ThrottledSession:  # pylint: disable=too-few-public-methods
+    """Session wrapper adding retries, backoff and an adaptive limit."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, session, limiter, retries=3, backoff=0.5, metrics=None
+    ):
+        """Wrap session, counting requests and retries in metrics if given."""
+        self.session = session
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+
+    def _record(self, started, status):
+        """Record a request's outcome in the limiter and metrics."""
+        overloaded = status is None or status in OVERLOAD_STATUSES
+        self.limiter.record(started, overloaded)
+        if self.metrics:
+            self.metrics.observe("request", time.monotonic() - started)
+            self.metrics.count("requests")
+            self.metrics.gauge("concurrency_limit", int(self.limiter.limit))
+
+    def _count_retry(self, reason):
+        """Count a retry."""
+        if self.metrics:
+            self.metrics.count("retries")
+            self.metrics.count(f"retries_{reason}")
+
+    async def get(self, url, headers=None):
+        """Get url, retrying connection errors, timeouts and throttled responses."""
+        attempt = 0
+        while True:
+            started = await self.limiter.acquire()
+            try:
+                response = await self.session.get(url, headers=headers)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.limiter.release()
+                self._record(started, None)
+                if attempt >= self.retries:
+                    raise
+                self._count_retry("connection")
+                await asyncio.sleep(get_backoff(attempt, self.backoff))
+                attempt += 1
+                continue
+            except BaseException:
+                self.limiter.release()
+                raise
+
+            self._record(started, response.status)
+            if response.status not in RETRY_STATUSES or attempt >= self.retries:
+                return LimitedResponse(response, self.limiter)
+
+            self._count_retry(response.status)
+            delay = get_retry_after(response.headers)
+            if delay is not None:
+                self.limiter.defer(delay)
+            else:
+                delay = get_backoff(attempt, self.backoff)
+
+            response.release()
+            self.limiter.release()
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,56 @@
+"""Content addressed store for downloaded tracks."""
+import asyncio
+import functools
+import os
+
+from aiofiles import os as async_os
+
+from file_links import link_into_place, symlink_relative
+
+
+class TrackStore:
+    """Tracks kept once by sha256 and linked into album folders."""
+
+    def __init__(self, path, symlink=False):
+        """Use the store at path."""
+        self.path = path
+        self.symlink = symlink
+
+    def get_path(self, digest):
+        """Return the stored path for a sha256 hex digest."""
+        return os.path.join(self.path, digest[:2], f"{digest}.mp3")
+
+    async def has(self, digest):
+        """Check if the store holds digest."""
+        return await async_os.path.exists(self.get_path(digest))
+
+    async def is_linked(self, digest, filename):
+        """Check if filename already points at the stored track."""
+        if not await async_os.path.exists(filename):
+            return False
+
+        return await async_os.path.samefile(self.get_path(digest), filename)
+
+    async def add(self, temp_filename, digest):
+        """Move a downloaded file into the store, keeping any existing copy."""
+        stored_path = self.get_path(digest)
+        if await async_os.path.exists(stored_path):
+            await async_os.remove(temp_filename)
+            return
+
+        await async_os.makedirs(os.path.dirname(stored_path), exist_ok=True)
+        await async_os.replace(temp_filename, stored_path)
+
+    async def link(self, digest, filename):
+        """Point filename at the stored track."""
+        event_loop = asyncio.get_event_loop()
+        await event_loop.run_in_executor(
+            None,
+            functools.partial(
+                link_into_place,
+                self.get_path(digest),
+                filename,
+                symlink_relative,
+                hardlink=not self.symlink,
+            ),
+        )
@@ -0,0 +1,99 @@
+"""Write ID3 tags into mp3 files while they stream to disk."""
+import io
+
+from mutagen import MutagenError
+from mutagen.id3 import ID3, TALB, TIT1, TIT2, TRCK, TXXX
+
+from rename_rules import NUMBERED_DESC
+
+ID3_HEADER_SIZE = 10
+
+
+def get_tag_size(header):
+    """Return the size of the ID3v2 tag a stream starts with, 0 if none."""
+    if header[:3] != b"ID3":
+        return 0
+
+    # The tag size is four 7 bit bytes and leaves out the header and footer.
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+
+    has_footer = header[5] & 0x10
+    return ID3_HEADER_SIZE + size + (ID3_HEADER_SIZE if has_footer else 0)
+
+
+def get_track_frames(collection_title, album_title, track_title, track_no):
+    """Return the ID3 frames to write for a track.
+
+    The collection goes in the content group frame, and a TXXX frame notes
+    the track number is final so metadata.py leaves the file as it is.
+    """
+    frames = [
+        TALB(encoding=3, text=album_title),
+        TIT2(encoding=3, text=track_title),
+        TRCK(encoding=3, text=str(track_no)),
+        TXXX(encoding=3, desc=NUMBERED_DESC, text="1"),
+    ]
+    if collection_title:
+        frames.append(TIT1(encoding=3, text=collection_title))
+
+    return frames
+
+
+def render_tag(data, frames):
+    """Return the ID3v2 tag in data, if any, with frames set in it."""
+    try:
+        tags = ID3(io.BytesIO(data)) if data else ID3()
+    except MutagenError:
+        # Replace a tag mutagen can not read.
+        data = b""
+        tags = ID3()
+
+    for frame in frames:
+        tags.setall(frame.HashKey, [frame])
+
+    buffer = io.BytesIO(data)
+    tags.save(buffer)
+    return buffer.getvalue()
+
+
+class TagRewriter:
+    """Set ID3 frames in the tag at the start of an mp3 stream.
+
+    Only the stream's own tag is held in memory; the audio after it passes
+    straight through, so the file is tagged in the same pass that writes it.
+    """
+
+    def __init__(self, frames):
+        """Rewrite the stream's tag with frames."""
+        self.frames = frames
+        self.buffer = b""
+        self.done = False
+
+    def feed(self, chunk):
+        """Return the bytes to write for the next chunk of the stream."""
+        if self.done:
+            return chunk
+
+        self.buffer += chunk
+        if len(self.buffer) < ID3_HEADER_SIZE:
+            return b""
+
+        tag_size = get_tag_size(self.buffer)
+        if len(self.buffer) < tag_size:
+            return b""
+
+        self.done = True
+        data, rest = self.buffer[:tag_size], self.buffer[tag_size:]
+        self.buffer = b""
+        return render_tag(data, self.frames) + rest
+
+    def close(self):
+        """Return what is left when the stream ends before its tag does."""
+        if self.done:
+            return b""
+
+        # Too short to be a track, so write it as it came.
+        self.done = True
+        return self.buffer
@@ -0,0 +1,149 @@
+"""Pick which of a track's download variants to fetch."""
+import logging
+import os
+import re
+import urllib.parse
+
+LOGGER = logging.getLogger(__name__)
+
+POLICIES = ["first", "smallest"]
+
+MIME_FORMATS = {
+    "audio/aac": "aac",
+    "audio/mp4": "m4a",
+    "audio/mpeg": "mp3",
+    "audio/ogg": "ogg",
+}
+
+
+def get_download_size(download):
+    """Return the byte size the site lists for a download, if any."""
+    for key in ("size", "fileSize"):
+        if str(download.get(key, "")).isdigit():
+            return int(download[key])
+
+    return None
+
+
+def get_download_bitrate(download):
+    """Return the bitrate in kbit/s the site lists for a download, if any."""
+    for key in ("bitrate", "bitRate", "kbps"):
+        match = re.match(r"\s*(\d+)", str(download.get(key, "")))
+        if match:
+            bitrate = int(match.group(1))
+            # Rates this high are in bit/s.
+            return bitrate // 1000 if bitrate >= 8000 else bitrate
+
+    return None
+
+
+def get_download_format(download):
+    """Return the lower case format of a download, from its fields or url."""
+    if download.get("format"):
+        return str(download["format"]).lower()
+
+    if download.get("mimeType") in MIME_FORMATS:
+        return MIME_FORMATS[download["mimeType"]]
+
+    path = urllib.parse.urlparse(download.get("url", "")).path
+    return os.path.splitext(path)[1][1:].lower() or None
+
+
+def get_download_extension(download):
+    """Return the file extension of a download's format, or mp3 if it has none."""
+    variant_format = get_download_format(download)
+    return variant_format if variant_format and variant_format.isalnum() else "mp3"
+
+
+def get_variant_label(download):
+    """Describe a download variant by its format and bitrate."""
+    bitrate = get_download_bitrate(download)
+    parts = [get_download_format(download), f"{bitrate}kbps" if bitrate else None]
+    return " ".join(part for part in parts if part) or None
+
+
+class VariantPolicy:
+    """Choose one of the downloads an item lists.
+
+    - first: the first variant, as the site lists them.
+    - smallest: the variant the site lists as smallest, and unsized ones last.
+
+    formats limits the variants to those formats, in order of preference.
+    With a bitrate, the highest bitrate at or under it is preferred, then the
+    lowest above it, then variants with no listed bitrate. max_size skips
+    variants listed as larger. An item with no variant left after formats
+    falls back to all its variants, and with none left after max_size to its
+    smallest one.
+    """
+
+    def __init__(self, policy="first", formats=None, bitrate=None, max_size=None):
+        """Rank variants by policy."""
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown variant policy {policy}")
+
+        self.policy = policy
+        self.formats = [variant_format.lower() for variant_format in formats or []]
+        self.bitrate = bitrate
+        self.max_size = max_size
+
+    @staticmethod
+    def get_size_key(download):
+        """Sort key for smallest first, with unsized variants last."""
+        size = get_download_size(download)
+        return size if size is not None else float("inf")
+
+    def get_rank(self, download):
+        """Return the sort key of a variant, lowest first."""
+        rank = []
+        if self.formats:
+            variant_format = get_download_format(download)
+            if variant_format in self.formats:
+                rank.append(self.formats.index(variant_format))
+            else:
+                rank.append(len(self.formats))
+
+        if self.bitrate:
+            bitrate = get_download_bitrate(download)
+            if bitrate is None:
+                rank.append((2, 0))
+            elif bitrate <= self.bitrate:
+                rank.append((0, -bitrate))
+            else:
+                rank.append((1, bitrate))
+
+        if self.policy == "smallest":
+            rank.append(self.get_size_key(download))
+
+        return rank
+
+    def fits(self, download):
+        """Check if a variant is not listed as larger than max_size."""
+        size = get_download_size(download)
+        return self.max_size is None or size is None or size <= self.max_size
+
+    def select(self, downloads):
+        """Return the chosen download of a downloads list, or None if it has none."""
+        variants = [
+            download
+            for download in downloads or []
+            if isinstance(download, dict) and download.get("url")
+        ]
+        if not variants:
+            return None
+
+        candidates = [
+            download
+            for download in variants
+            if not self.formats or get_download_format(download) in self.formats
+        ] or variants
+        fitting = [download for download in candidates if self.fits(download)]
+        if not fitting:
+            download = min(candidates, key=self.get_size_key)
+            LOGGER.warning(
+                "No variant under %s bytes, taking the smallest: %s",
+                self.max_size,
+                download["url"],
+            )
+            return download
+
+        return min(fitting, key=self.get_rank)
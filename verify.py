@@ -0,0 +1,258 @@
+#!/usr/bin/python
+"""Check downloaded tracks for empty, truncated and non mp3 files."""
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import mmap
+import os
+import sys
+import time
+
+from manifest import Manifest
+from metadata import get_music_files
+
+# Bitrates in kbit/s by bitrate index, for MPEG 1 and MPEG 2 and 2.5 layers.
+BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Sample rates by version bits, 0 for MPEG 2.5, 2 for MPEG 2 and 3 for MPEG 1.
+SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+ID3_HEADER_SIZE = 10
+# Bytes after the ID3 tag to look for the first frame in.
+SYNC_WINDOW = 64 * 1024
+
+
+def get_frame_size(header):
+    """Return the length of the MPEG audio frame a 4 byte header starts, or None."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+
+    version = (header[1] >> 3) & 0x03
+    layer = 4 - ((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    # Reserved values, and free format, which can not be checked.
+    if version == 1 or layer == 4 or bitrate_index in (0, 15):
+        return None
+    if sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 3 else 2, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4
+
+    if layer == 3 and version != 3:
+        return 72 * bitrate // sample_rate + padding
+
+    return 144 * bitrate // sample_rate + padding
+
+
+def get_id3_size(data):
+    """Return the size of a valid ID3v2 tag at the start of data.
+
+    Return 0 without a tag and None for a broken tag header.
+    """
+    if data[:3] != b"ID3":
+        return 0
+
+    header = data[:ID3_HEADER_SIZE]
+    if len(header) < ID3_HEADER_SIZE or header[3] not in (2, 3, 4):
+        return None
+    if header[4] == 0xFF or any(byte & 0x80 for byte in header[6:10]):
+        return None
+
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | byte
+
+    has_footer = header[3] == 4 and header[5] & 0x10
+    return ID3_HEADER_SIZE + size + (ID3_HEADER_SIZE if has_footer else 0)
+
+
+def find_frame(data, start):
+    """Return the offset of the first MPEG frame from start, or None.
+
+    A frame counts when another frame header follows it or the file ends.
+    """
+    end = min(len(data), start + SYNC_WINDOW)
+    offset = data.find(b"\xff", start, end)
+    while offset != -1:
+        frame_size = get_frame_size(data[offset : offset + 4])
+        if frame_size:
+            next_offset = offset + frame_size
+            if next_offset >= len(data) or get_frame_size(
+                data[next_offset : next_offset + 4]
+            ):
+                return offset
+        offset = data.find(b"\xff", offset + 1, end)
+
+    return None
+
+
+def check_data(data, expected_size=None):
+    """Return what is wrong with an mp3's data, or None."""
+    if data[:64].lstrip().startswith(b"<"):
+        return "html or xml instead of mp3"
+
+    tag_size = get_id3_size(data)
+    if tag_size is None:
+        return "bad ID3 header"
+    if tag_size > len(data):
+        return "ID3 tag longer than file"
+
+    if find_frame(data, tag_size) is None:
+        return "no MPEG frame sync"
+
+    if expected_size is not None and len(data) != expected_size:
+        return f"size {len(data)}, expected {expected_size}"
+
+    return None
+
+
+def check_file(filepath, expected_size=None):
+    """Return what is wrong with an mp3 file, or None.
+
+    The file is memory mapped, so only the bytes checked are read.
+    """
+    try:
+        with open(filepath, "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return "empty"
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return check_data(data, expected_size)
+    except OSError as error:
+        return str(error)
+
+
+def check_files(files, workers=None, processes=False):
+    """Check many (filepath, expected_size) files in a thread or process pool.
+
+    Return a dict of problems by filepath for the files that have one.
+    """
+    if processes:
+        executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    filepaths = [filepath for filepath, _ in files]
+    sizes = [size for _, size in files]
+    with executor:
+        problems = executor.map(check_file, filepaths, sizes, chunksize=64)
+        return {
+            filepath: problem
+            for filepath, problem in zip(filepaths, problems)
+            if problem
+        }
+
+
+def requeue(manifest, entries, filepath):
+    """Remove a bad file and its manifest entry so the next crawl fetches it."""
+    entry = entries.get(filepath)
+    if entry:
+        manifest.remove(entry.url)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(filepath)
+
+
+def main():
+    """Check every track under the music path."""
+    started = time.monotonic()
+    # The manifest keeps absolute paths, as main.py resolves the music folder.
+    music_path = os.path.abspath(MUSIC_PATH)
+    manifest = Manifest(MANIFEST_PATH or os.path.join(music_path, ".manifest.sqlite"))
+    try:
+        entries = {
+            os.path.abspath(path): entry for path, entry in manifest.get_all().items()
+        }
+        filepaths = [
+            filepath
+            for filepath in get_music_files(music_path)
+            if filepath.endswith(".mp3")
+        ]
+        files = [
+            (filepath, entries[filepath].size if filepath in entries else None)
+            for filepath in filepaths
+        ]
+        problems = check_files(files, WORKERS, PROCESSES)
+        for filepath, problem in sorted(problems.items()):
+            print(f"{filepath}: {problem}")
+            if REQUEUE:
+                requeue(manifest, entries, filepath)
+    finally:
+        manifest.close()
+
+    print(
+        f"Checked {len(filepaths)} tracks in {time.monotonic() - started:.1f}s, "
+        f"{len(problems)} bad" + (", removed to download again" if REQUEUE else "")
+    )
+    if OUTPUT_PATH:
+        with open(OUTPUT_PATH, "w", encoding="utf-8") as file:
+            json.dump(problems, file, indent=2)
+            file.write("\n")
+
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Church Music Scraper - Verify.",
+        add_help=True,
+    )
+    parser.add_argument(
+        "--music_path",
+        "-m",
+        help="Path to music folder",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Download manifest with the expected sizes. Defaults to the music folder.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(32, (os.cpu_count() or 1) * 4),
+        help="Number of threads, or processes, checking files.",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Check files in a process pool instead of threads.",
+    )
+    parser.add_argument(
+        "--requeue",
+        action="store_true",
+        help="Delete bad files and their manifest entries so main.py downloads them again.",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="Write bad files and their problems to a json file.",
+    )
+    args = parser.parse_args()
+
+    MUSIC_PATH = args.music_path or os.environ.get("MUSIC_PATH")
+    MANIFEST_PATH = args.manifest
+    WORKERS = args.workers
+    PROCESSES = args.processes
+    REQUEUE = args.requeue
+    OUTPUT_PATH = args.output
+
+    if not MUSIC_PATH:
+        raise ValueError(
+            "Music path is required. Have you set the MUSIC_PATH env variable?"
+        )
+
+    sys.exit(main())
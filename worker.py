@@ -0,0 +1,133 @@
+"""Take crawl jobs from stdin or a Unix socket in one long running process."""
+import asyncio
+import collections
+import contextlib
+import itertools
+import json
+import logging
+import os
+import signal
+import stat
+import sys
+
+LOGGER = logging.getLogger(__name__)
+
+Job = collections.namedtuple("Job", ["job_id", "entry", "writer", "done"])
+
+
+def remove_socket(path):
+    """Remove a socket left at path, but never another kind of file."""
+    with contextlib.suppress(FileNotFoundError):
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+
+
+class JobWorker:
+    """Queue of crawl jobs run one at a time, reporting each job's status.
+
+    Every job line gets a "queued" status and then a final status from
+    run_job, as json lines on stdout or on the socket connection it came
+    from. Whatever run_job keeps open, such as the http session, caches and
+    parser processes, stays warm from one job to the next.
+    """
+
+    def __init__(self, run_job, parse_job):
+        """Run jobs with the async run_job(job_id, entry), parsing lines with parse_job.
+
+        parse_job returns None for lines that are not jobs.
+        """
+        self.run_job = run_job
+        self.parse_job = parse_job
+        self.jobs = asyncio.Queue()
+        self.job_ids = itertools.count(1)
+
+    @staticmethod
+    def write_status(writer, status):
+        """Send a status line to writer, or stdout without one."""
+        line = json.dumps(status)
+        if writer is None:
+            print(line, flush=True)
+        elif not writer.is_closing():
+            writer.write(line.encode("utf-8") + b"\n")
+
+    async def add_line(self, line, writer=None):
+        """Queue the job on line, returning a future done when it has run."""
+        done = asyncio.get_event_loop().create_future()
+        line = line.strip()
+        entry = self.parse_job(line)
+        if entry is None:
+            if line and not line.startswith("#"):
+                self.write_status(writer, {"line": line, "status": "invalid"})
+            done.set_result(None)
+            return done
+
+        job = Job(next(self.job_ids), entry, writer, done)
+        self.write_status(writer, {"job": job.job_id, "status": "queued"})
+        await self.jobs.put(job)
+        return done
+
+    async def run(self):
+        """Run queued jobs until a None job."""
+        while True:
+            job = await self.jobs.get()
+            if job is None:
+                return
+
+            try:
+                status = await self.run_job(job.job_id, job.entry)
+            except Exception:  # pylint: disable=broad-except
+                LOGGER.exception("Job %s failed", job.job_id)
+                status = {"job": job.job_id, "status": "failed"}
+            self.write_status(job.writer, status)
+            job.done.set_result(status)
+
+    async def read_stdin(self):
+        """Queue a job for each stdin line, then a None job at the end."""
+        event_loop = asyncio.get_event_loop()
+        while True:
+            line = await event_loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            await self.add_line(line)
+
+        await self.jobs.put(None)
+
+    async def read_connection(self, reader, writer):
+        """Queue a job for each line of a socket connection.
+
+        The connection closes once its jobs have run.
+        """
+        pending = []
+        try:
+            async for line in reader:
+                pending.append(await self.add_line(line.decode("utf-8"), writer))
+            await asyncio.gather(*pending)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None):
+        """Run jobs from stdin until it ends, or from socket_path until stopped."""
+        if socket_path is None:
+            reader = asyncio.ensure_future(self.read_stdin())
+            await self.run()
+            await reader
+            return
+
+        remove_socket(socket_path)
+        server = await asyncio.start_unix_server(self.read_connection, socket_path)
+        LOGGER.info("Waiting for jobs on %s", socket_path)
+        # Stop on SIGTERM like on Ctrl-C, closing the session and caches.
+        running = asyncio.ensure_future(self.run())
+        event_loop = asyncio.get_event_loop()
+        event_loop.add_signal_handler(signal.SIGTERM, running.cancel)
+        try:
+            async with server:
+                await running
+        except asyncio.CancelledError:
+            LOGGER.info("Stopped waiting for jobs on %s", socket_path)
+        finally:
+            event_loop.remove_signal_handler(signal.SIGTERM)
+            remove_socket(socket_path)